@@ -1,3 +1,4 @@
+import shutil
 from merlin.settings import *
 
 # Database
@@ -17,3 +18,15 @@ DATABASES = {
     }
 }
 
+# Share cached results between the uwsgi processes
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': '/var/webstack-data/django-cache',
+    }
+}
+
+# uwsgi runs 4 processes, each with its own pool of simulation workers
+MERLIN_MAX_WORKERS = 2
+MERLIN_MAX_PARALLEL_BATCHES = 1
+MERLIN_WORKER_PYTHON = shutil.which('python3')
@@ -49,6 +49,7 @@ MIDDLEWARE_CLASSES = [
     'django.contrib.auth.middleware.SessionAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'merlin_api.middleware.QueryProfileMiddleware',
 ]
 
 REST_FRAMEWORK = {
@@ -94,6 +95,16 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/1.9/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
 
@@ -131,3 +142,55 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/1.9/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Merlin
+
+# Number of hydrated simulations each worker keeps in memory
+MERLIN_SIM_CACHE_SIZE = 8
+
+# Cache alias and timeout (seconds) for simulation telemetry
+MERLIN_RESULT_CACHE = 'default'
+MERLIN_RESULT_CACHE_TIMEOUT = 3600
+
+# Seconds a simulation job worker sleeps when the queue is empty
+MERLIN_WORKER_POLL_INTERVAL = 1.0
+
+# Seconds after which a running job is assumed to belong to a dead worker
+# and is queued again, None disables requeueing
+MERLIN_JOB_TIMEOUT = 3600
+
+# Worker processes for batch runs, None means one per CPU. Each web worker
+# process has its own pool, so deployments with several web processes
+# should cap it. At most MERLIN_MAX_PARALLEL_BATCHES requests of a process
+# use the pool at the same time. The pool is started with the python in
+# MERLIN_WORKER_PYTHON, which must be set when running under uwsgi as
+# sys.executable is the uwsgi binary there
+MERLIN_MAX_WORKERS = None
+MERLIN_MAX_PARALLEL_BATCHES = 2
+MERLIN_WORKER_PYTHON = None
+
+# Steps between run checkpoints, 0 disables checkpointing, and the number
+# of checkpoints each worker keeps in memory
+MERLIN_CHECKPOINT_INTERVAL = 0
+MERLIN_CHECKPOINT_CACHE_SIZE = 32
+
+# Number of scenarios whose parsed events each worker keeps in memory
+MERLIN_SCENARIO_CACHE_SIZE = 256
+
+# Per request query profiling, see merlin_api.middleware. It keeps every
+# statement of a request in memory, so it is on with DEBUG only. Settings
+# that change DEBUG after importing these must set it again
+MERLIN_QUERY_PROFILE = DEBUG
+MERLIN_QUERY_PROFILE_TOP_N = 5
+MERLIN_QUERY_DUPLICATE_THRESHOLD = 10
+
+# Models with at least this many entities are imported with COPY
+MERLIN_COPY_IMPORT_THRESHOLD = 5000
+
+# Modules whose process classes are registered at startup, see
+# merlin_api.process_registry
+MERLIN_PROCESS_MODULES = ['pymerlin.processes']
+
+# Simulations hydrated by the uwsgi master before forking workers
+MERLIN_WARMUP_SIMULATIONS = []
@@ -1,7 +1,9 @@
+import shutil
 from merlin.settings import *
 
 # for pre-production
 DEBUG = False
+MERLIN_QUERY_PROFILE = False
 ALLOWED_HOSTS = ["localhost", "192.168.99.100"]
 SECRET_KEY = 'sdakl aeorij23jfalkja adsfjjeoriewoiu2034982398409'
 
@@ -19,3 +21,15 @@ DATABASES = {
     }
 }
 
+# Share cached results between the uwsgi processes
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': '/var/webstack-data/django-cache',
+    }
+}
+
+# uwsgi runs 4 processes, each with its own pool of simulation workers
+MERLIN_MAX_WORKERS = 2
+MERLIN_MAX_PARALLEL_BATCHES = 1
+MERLIN_WORKER_PYTHON = shutil.which('python3')
@@ -39,6 +39,12 @@ router.register(
     r'simulation-run',
     views.SimulationRunViewSet,
     base_name='simulation-run')
+router.register(r'simulation-jobs', views.SimulationJobViewSet)
+router.register(r'runs', views.RunViewSet)
+router.register(
+    r'process-classes',
+    views.ProcessClassViewSet,
+    base_name='process-class')
 
 urlpatterns = [
     url(r'^api/', include(router.urls)),
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "merlin.settings")
 
 application = get_wsgi_application()
+
+if os.environ.get('MERLIN_WARMUP'):
+    # runs in the uwsgi master before the workers are forked
+    from merlin_api.warmup import warmup
+    warmup()
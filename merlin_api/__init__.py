@@ -0,0 +1 @@
+default_app_config = 'merlin_api.apps.MerlinApiConfig'
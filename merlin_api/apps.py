@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class MerlinApiConfig(AppConfig):
     name = 'merlin_api'
+
+    def ready(self):
+        # connect the model signal handlers and register the checks
+        from . import checks, signals  # noqa: F401
+        from .process_registry import load_process_modules
+        load_process_modules()
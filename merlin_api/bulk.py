@@ -0,0 +1,563 @@
+import copy
+import csv
+import io
+import json
+import logging
+from typing import Any, List, Mapping, Sequence
+from django.conf import settings
+from django.db import connection, models as db_models, transaction
+from django.utils import timezone
+from pymerlin import merlin
+from . import models, signals
+from .sim_cache import checkpoint_cache, simulation_cache
+from .pymerlin_adapter import get_fullname_from_process_class
+
+logger = logging.getLogger('merlin_api.bulk')
+
+# Set based operations on whole simulations
+
+
+BATCH_SIZE = 1000
+
+
+def reserve_ids(model: db_models.Model, count: int) -> List[int]:
+    """
+    Draws count ids from the primary key sequence of model in one query, so
+    rows can reference each other before any of them are inserted.
+    """
+    if count == 0:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence(%s, 'id')) "
+            "FROM generate_series(1, %s)",
+            [model._meta.db_table, count])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _copy_value(value) -> str:
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (list, tuple)):
+        # postgres array literal
+        return '{' + ','.join(
+            '"' + str(v).replace('\\', '\\\\').replace('"', '\\"') + '"'
+            for v in value) + '}'
+    if hasattr(value, 'adapted'):
+        # psycopg2 Json wrapper of a JSONField
+        return json.dumps(value.adapted)
+    if isinstance(value, dict):
+        return json.dumps(value)
+    return str(value)
+
+
+def copy_insert(model: db_models.Model, objs: Sequence[db_models.Model]):
+    """
+    Inserts objs with a single COPY statement. Every object must have its
+    primary key set, see reserve_ids.
+    """
+    if not objs:
+        return
+    fields = model._meta.concrete_fields
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for obj in objs:
+        writer.writerow([
+            _copy_value(f.get_db_prep_save(
+                getattr(obj, f.attname), connection))
+            for f in fields])
+    buf.seek(0)
+    sql = "COPY {0} ({1}) FROM STDIN WITH (FORMAT csv, NULL '\\N')".format(
+        connection.ops.quote_name(model._meta.db_table),
+        ', '.join(connection.ops.quote_name(f.column) for f in fields))
+    with connection.cursor() as cursor:
+        cursor.copy_expert(sql, buf)
+
+
+def bulk_insert(model: db_models.Model, objs: Sequence[db_models.Model]):
+    model.objects.bulk_create(objs, batch_size=BATCH_SIZE)
+
+
+def import_simulation(sim: merlin.Simulation, use_copy: bool=None) -> int:
+    """
+    Inserts the simulation into the database like
+    pymerlin_adapter.pymerlin2django, but with one bulk insert per table
+    inside a single transaction. Ids are reserved up front, so parent links
+    and connector descriptions are written with the rows instead of by a
+    second round of saves.
+
+    :param use_copy: insert with COPY rather than INSERT, by default COPY is
+     used for models with at least MERLIN_COPY_IMPORT_THRESHOLD entities
+    :returns: the id for this simulation within the database
+    """
+    entities = list(sim.get_entities())
+    outputs = list(sim.outputs)
+    if use_copy is None:
+        use_copy = len(entities) >= getattr(
+            settings, 'MERLIN_COPY_IMPORT_THRESHOLD', 5000)
+    insert = copy_insert if use_copy else bulk_insert
+
+    # KLUDGE: In lieu of process input/output db entitites the connector
+    # descriptions list the names of the process inputs/outputs using them
+    input_names = dict()
+    output_names = dict()
+    for e in entities:
+        for p in e.get_processes():
+            for i in p.inputs.values():
+                input_names.setdefault(i.connector.id, []).append(i.name)
+            for o in p.outputs.values():
+                output_names.setdefault(o.connector.id, []).append(o.name)
+
+    with transaction.atomic():
+        # Simulation
+        dsim = models.Simulation()
+        dsim.num_steps = sim.num_steps
+        dsim.name = sim.name
+        dsim.save()
+
+        # Attributes
+        attributes = list(sim.get_attributes())
+        insert(models.Attribute, [
+            models.Attribute(id=a_id, sim_id=dsim.id, value=a)
+            for a, a_id in zip(
+                attributes,
+                reserve_ids(models.Attribute, len(attributes)))])
+
+        # Unit Types
+        unit_types = list(sim.get_unit_types())
+        ut_ids = dict(zip(
+            unit_types, reserve_ids(models.UnitType, len(unit_types))))
+        insert(models.UnitType, [
+            models.UnitType(id=ut_ids[ut], sim_id=dsim.id, value=ut)
+            for ut in unit_types])
+
+        # Outputs
+        output_ids = dict(zip(
+            [o.id for o in outputs],
+            reserve_ids(models.Output, len(outputs))))
+        insert(models.Output, [
+            models.Output(
+                id=output_ids[o.id],
+                name=o.name,
+                sim_id=dsim.id,
+                unit_type_id=ut_ids[o.type],
+                minimum=o.minimum)
+            for o in outputs])
+
+        # Entities, with their parent relations
+        entity_ids = dict(zip(
+            [e.id for e in entities],
+            reserve_ids(models.Entity, len(entities))))
+        source_entities = set(sim.source_entities)
+        insert(models.Entity, [
+            models.Entity(
+                id=entity_ids[e.id],
+                name=e.name,
+                sim_id=dsim.id,
+                attributes=list(e.attributes),
+                is_source=(e in source_entities),
+                parent_id=entity_ids[e.parent.id] if e.parent else None)
+            for e in entities])
+
+        # Output connectors
+        m_output_cons = [(e, o) for e in entities for o in e.outputs]
+        output_con_ids = dict(zip(
+            [o.id for _, o in m_output_cons],
+            reserve_ids(models.OutputConnector, len(m_output_cons))))
+        insert(models.OutputConnector, [
+            models.OutputConnector(
+                id=output_con_ids[o.id],
+                parent_id=entity_ids[e.id],
+                unit_type_id=ut_ids[o.type],
+                name=o.name,
+                description=','.join(output_names.get(o.id, [])),
+                apportion_rule=o.apportioning.value)
+            for e, o in m_output_cons])
+
+        # Input connectors, with their source references
+        m_input_cons = [(e, i) for e in entities for i in e.inputs]
+        input_con_ids = dict(zip(
+            [i.id for _, i in m_input_cons],
+            reserve_ids(models.InputConnector, len(m_input_cons))))
+        dinput_cons = list()
+        for e, i in m_input_cons:
+            if i.source is None:
+                logger.error(
+                    """
+                        Input has no source reference!
+
+                        ENTITY:
+                            {0}
+
+                        INPUT:
+                            {1}""".format(e, i))
+            dinput_cons.append(models.InputConnector(
+                id=input_con_ids[i.id],
+                parent_id=entity_ids[e.id],
+                additive_write=i.additive_write,
+                name=i.name,
+                description=','.join(input_names.get(i.id, [])),
+                unit_type_id=ut_ids[i.type],
+                source_id=(
+                    output_con_ids[i.source.id] if i.source else None)))
+        insert(models.InputConnector, dinput_cons)
+
+        # Sim output connectors
+        m_sim_output_cons = [(op, i) for op in outputs for i in op.inputs]
+        sim_output_con_ids = dict(zip(
+            [i.id for _, i in m_sim_output_cons],
+            reserve_ids(models.SimOutputConnector, len(m_sim_output_cons))))
+        insert(models.SimOutputConnector, [
+            models.SimOutputConnector(
+                id=sim_output_con_ids[i.id],
+                parent_id=output_ids[op.id],
+                additive_write=i.additive_write,
+                name=i.name,
+                unit_type_id=ut_ids[i.type],
+                source_id=output_con_ids[i.source.id])
+            for op, i in m_sim_output_cons])
+
+        # Endpoints
+        dendpoints = list()
+        for _, o in m_output_cons:
+            for ep in o.get_endpoint_objects():
+                dendpoint = models.Endpoint(
+                    parent_id=output_con_ids[o.id],
+                    bias=ep.bias)
+                if ep.connector.id in input_con_ids:
+                    dendpoint.input_id = input_con_ids[ep.connector.id]
+                else:
+                    dendpoint.sim_output_id = \
+                        sim_output_con_ids[ep.connector.id]
+                dendpoints.append(dendpoint)
+        for ep, ep_id in zip(
+                dendpoints, reserve_ids(models.Endpoint, len(dendpoints))):
+            ep.id = ep_id
+        insert(models.Endpoint, dendpoints)
+
+        # Processes and their properties
+        m_processes = [(e, p) for e in entities for p in e.get_processes()]
+        process_ids = reserve_ids(models.Process, len(m_processes))
+        dprocesses = list()
+        dproperties = list()
+        for (e, p), p_id in zip(m_processes, process_ids):
+            dprocesses.append(models.Process(
+                id=p_id,
+                parent_id=entity_ids[e.id],
+                name=p.name,
+                priority=p.priority,
+                process_class=get_fullname_from_process_class(type(p)),
+                parameters=p.default_params))
+            for ps in p.get_properties():
+                dproperties.append(models.ProcessProperty(
+                    name=ps.name,
+                    readonly=ps.readonly,
+                    process_id=p_id,
+                    property_type=ps.type.value,
+                    default_value=ps.default,
+                    max_value=ps.max_val if ps.max_val else None,
+                    min_value=ps.min_val if ps.min_val else None,
+                    property_value=ps.get_value()))
+        insert(models.Process, dprocesses)
+        for pp, pp_id in zip(
+                dproperties,
+                reserve_ids(models.ProcessProperty, len(dproperties))):
+            pp.id = pp_id
+        insert(models.ProcessProperty, dproperties)
+
+    return dsim.id
+
+
+def update_positions(
+        sim_id: int,
+        model: db_models.Model,
+        positions: Sequence[Mapping[str, float]]) -> int:
+    """
+    Sets the display position of Entity or Output rows of a simulation
+    with one UPDATE ... FROM (VALUES ...) statement per batch. Ids that are
+    not part of the simulation are ignored.
+
+    :param positions: dicts with the id, x and y of each row
+    :returns: the number of rows updated
+    """
+    updated = 0
+    with connection.cursor() as cursor:
+        for start in range(0, len(positions), BATCH_SIZE):
+            batch = positions[start:start + BATCH_SIZE]
+            sql = (
+                "UPDATE {0} AS t "
+                "SET display_pos_x = v.x, display_pos_y = v.y "
+                "FROM (VALUES {1}) AS v(id, x, y) "
+                "WHERE t.id = v.id AND t.sim_id = %s").format(
+                    connection.ops.quote_name(model._meta.db_table),
+                    ', '.join(
+                        ['(%s, %s::double precision, %s::double precision)'] *
+                        len(batch)))
+            params = [v for p in batch for v in (p['id'], p['x'], p['y'])]
+            cursor.execute(sql, params + [sim_id])
+            updated += cursor.rowcount
+    return updated
+
+
+def update_layout(
+        sim_id: int,
+        entities: Sequence[Mapping[str, float]]=(),
+        outputs: Sequence[Mapping[str, float]]=()) -> Mapping[str, int]:
+    """
+    Applies entity and output positions of a simulation in one transaction
+    and bumps the simulation layout revision once if anything moved.
+    Positions aren't part of the hydrated graph, so the simulation
+    revision and the caches keyed on it are left alone.
+
+    :returns: the number of entities and outputs updated
+    """
+    with transaction.atomic():
+        result = {
+            'entities': update_positions(sim_id, models.Entity, entities),
+            'outputs': update_positions(sim_id, models.Output, outputs),
+        }
+        if result['entities'] or result['outputs']:
+            signals.layout_changed(sim_id)
+    return result
+
+
+# The rows of a simulation in deletion order, with the lookup from each
+# model to the simulation id. Rows go before the rows they reference, so
+# unit types, which are PROTECTed, are removed once nothing uses them.
+DELETE_ORDER = [
+    (models.Endpoint, 'parent__parent__sim_id'),
+    (models.ProcessProperty, 'process__parent__sim_id'),
+    (models.Process, 'parent__sim_id'),
+    (models.SimOutputConnector, 'parent__sim_id'),
+    (models.InputConnector, 'parent__sim_id'),
+    (models.OutputConnector, 'parent__sim_id'),
+    (models.Entity, 'sim_id'),
+    (models.Output, 'sim_id'),
+    (models.Event, 'scenario__sim_id'),
+    (models.Scenario, 'sim_id'),
+    (models.SimulationJob, 'sim_id'),
+    (models.SimulationRun, 'sim_id'),
+    (models.Attribute, 'sim_id'),
+    (models.UnitType, 'sim_id'),
+    (models.Simulation, 'id'),
+]
+
+
+def delete_rows(queryset: db_models.QuerySet) -> int:
+    """
+    Deletes the rows of queryset with a single DELETE statement, without
+    collecting them or following their relations like QuerySet.delete.
+    :returns: the number of rows deleted
+    """
+    sql, params = queryset.values('id').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'DELETE FROM {0} WHERE id IN ({1})'.format(
+                connection.ops.quote_name(queryset.model._meta.db_table),
+                sql),
+            params)
+        return cursor.rowcount
+
+
+def delete_simulation(sim_id: int) -> Mapping[str, int]:
+    """
+    Deletes a simulation with one statement per table inside a single
+    transaction, instead of letting the ORM collect every row of the graph.
+    Project phases of its scenarios are kept with their scenario unset.
+    Deletion jobs, and run jobs that are still pending or running, are kept
+    with their sim unset, the run jobs are marked failed. A worker that is
+    running one of them can still record its result. No signals are sent.
+
+    :returns: the number of rows deleted per model
+    """
+    deleted = dict()
+    with transaction.atomic():
+        models.ProjectPhase.objects.filter(
+            scenario__sim_id=sim_id).update(scenario=None)
+        models.SimulationJob.objects.filter(
+            sim_id=sim_id,
+            kind=models.SimulationJob.DELETE).update(sim=None)
+        models.SimulationJob.objects.filter(
+            sim_id=sim_id,
+            kind=models.SimulationJob.RUN,
+            status__in=[
+                models.SimulationJob.PENDING,
+                models.SimulationJob.RUNNING]).update(
+            sim=None,
+            status=models.SimulationJob.FAILED,
+            result={'message': ['simulation {0} was deleted'.format(
+                sim_id)]},
+            finished=timezone.now())
+        for model, lookup in DELETE_ORDER:
+            deleted[model.__name__] = delete_rows(
+                model.objects.filter(**{lookup: sim_id}))
+    simulation_cache.invalidate(sim_id)
+    checkpoint_cache.invalidate(sim_id)
+    return deleted
+
+
+# The rows copied by clone_simulation in insertion order, with the lookup
+# from each model to the simulation id. Events are copied separately since
+# their actions refer to entity and property ids.
+CLONE_ORDER = [
+    (models.UnitType, 'sim_id'),
+    (models.Attribute, 'sim_id'),
+    (models.Output, 'sim_id'),
+    (models.Entity, 'sim_id'),
+    (models.OutputConnector, 'parent__sim_id'),
+    (models.InputConnector, 'parent__sim_id'),
+    (models.SimOutputConnector, 'parent__sim_id'),
+    (models.Endpoint, 'parent__parent__sim_id'),
+    (models.Process, 'parent__sim_id'),
+    (models.ProcessProperty, 'process__parent__sim_id'),
+]
+
+# Operand types of event actions that hold an id as their first parameter
+ACTION_ID_OPERANDS = {
+    'Entity': models.Entity,
+    'Property': models.ProcessProperty,
+}
+
+
+def create_id_map(cursor, queryset: db_models.QuerySet) -> str:
+    """
+    Creates a temporary table pairing the id of every row of queryset with
+    a new id drawn from the sequence of its model.
+    :returns: the name of the table, with old_id and new_id columns
+    """
+    opts = queryset.model._meta
+    table = 'merlin_clone_{0}'.format(opts.model_name)
+    sql, params = queryset.values('id').query.sql_with_params()
+    cursor.execute('DROP TABLE IF EXISTS {0}'.format(table))
+    cursor.execute(
+        "CREATE TEMP TABLE {0} ON COMMIT DROP AS "
+        "SELECT src.id AS old_id, "
+        "nextval(pg_get_serial_sequence(%s, 'id')) AS new_id "
+        "FROM ({1}) AS src".format(table, sql),
+        [opts.db_table] + list(params))
+    cursor.execute('CREATE UNIQUE INDEX ON {0} (old_id)'.format(table))
+    cursor.execute('ANALYZE {0}'.format(table))
+    return table
+
+
+def copy_rows(
+        cursor,
+        model: db_models.Model,
+        id_maps: Mapping[db_models.Model, str],
+        constants: Mapping[str, Any]):
+    """
+    Copies the rows listed in the id map of model with one
+    INSERT ... SELECT. Foreign keys to models with an id map are pointed at
+    the copies, all other columns are copied as they are unless they are
+    given in constants.
+    """
+    qn = connection.ops.quote_name
+    columns = list()
+    selects = list()
+    joins = list()
+    params = list()
+    for i, f in enumerate(model._meta.concrete_fields):
+        columns.append(qn(f.column))
+        related = f.related_model if f.many_to_one else None
+        if f.primary_key:
+            selects.append('m.new_id')
+        elif f.column in constants:
+            selects.append('%s')
+            params.append(constants[f.column])
+        elif related in id_maps:
+            alias = 'f{0}'.format(i)
+            joins.append('LEFT JOIN {0} AS {1} ON {1}.old_id = t.{2}'.format(
+                id_maps[related], alias, qn(f.column)))
+            selects.append(alias + '.new_id')
+        else:
+            selects.append('t.' + qn(f.column))
+    cursor.execute(
+        'INSERT INTO {0} ({1}) SELECT {2} FROM {0} AS t '
+        'JOIN {3} AS m ON m.old_id = t.id {4}'.format(
+            qn(model._meta.db_table),
+            ', '.join(columns),
+            ', '.join(selects),
+            id_maps[model],
+            ' '.join(joins)),
+        params)
+
+
+def remap_actions(
+        actions: List[Mapping[str, Any]],
+        ids: Mapping[db_models.Model, Mapping[int, int]]) -> \
+        List[Mapping[str, Any]]:
+    """
+    :returns: a copy of serialized event actions with the entity and
+     property ids they refer to replaced by those in ids
+    """
+    actions = copy.deepcopy(actions)
+    for action in actions:
+        for key in ('operand_1', 'operand_2'):
+            operand = action.get(key)
+            if not isinstance(operand, dict):
+                continue
+            model = ACTION_ID_OPERANDS.get(operand.get('type'))
+            params = operand.get('params')
+            if model is not None and params:
+                params[0] = ids[model].get(params[0], params[0])
+    return actions
+
+
+def clone_simulation(
+        sim_id: int, name: str=None, scenarios: bool=False) -> int:
+    """
+    Copies a simulation graph inside the database in one transaction, with
+    one INSERT ... SELECT per table. New ids are drawn up front into
+    temporary old id to new id tables, which the copies join against to
+    remap their foreign keys.
+
+    :param name: the name of the copy, by default that of the original
+    :param scenarios: also copy the scenarios, with the entity and property
+     ids in their event actions pointed at the copies
+    :returns: the id of the copy
+    """
+    with transaction.atomic():
+        sim = models.Simulation.objects.get(pk=sim_id)
+        clone = models.Simulation.objects.create(
+            name=sim.name if name is None else name,
+            description=sim.description,
+            num_steps=sim.num_steps,
+            start_date=sim.start_date)
+
+        plan = list(CLONE_ORDER)
+        if scenarios:
+            plan.append((models.Scenario, 'sim_id'))
+        with connection.cursor() as cursor:
+            id_maps = dict()
+            for model, lookup in plan:
+                id_maps[model] = create_id_map(
+                    cursor, model.objects.filter(**{lookup: sim_id}))
+            for model, _ in plan:
+                constants = {'sim_id': clone.id}
+                if issubclass(model, models.Revisioned):
+                    constants['revision'] = 0
+                copy_rows(cursor, model, id_maps, constants)
+
+            if scenarios:
+                ids = dict()
+                for model in list(ACTION_ID_OPERANDS.values()) + \
+                        [models.Scenario]:
+                    cursor.execute(
+                        'SELECT old_id, new_id FROM {0}'.format(
+                            id_maps[model]))
+                    ids[model] = dict(cursor.fetchall())
+                bulk_insert(models.Event, [
+                    models.Event(
+                        scenario_id=ids[models.Scenario][e.scenario_id],
+                        name=e.name,
+                        description=e.description,
+                        time=e.time,
+                        actions=remap_actions(e.actions, ids))
+                    for e in models.Event.objects.filter(
+                        scenario__sim_id=sim_id)])
+
+            for model, _ in plan:
+                cursor.execute('DROP TABLE {0}'.format(id_maps[model]))
+    return clone.id
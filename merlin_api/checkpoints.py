@@ -0,0 +1,63 @@
+import hashlib
+import json
+from typing import Any, List, Mapping
+from django.conf import settings
+from . import models
+
+# Keys for snapshots of simulation state taken part way through a run.
+#
+# The state after step t depends only on the simulation graph and the
+# events that fire at or before t. A snapshot keyed by those can therefore
+# seed any later run that agrees with it up to t, whatever events it has
+# after t and however many steps it runs for.
+
+
+def get_interval() -> int:
+    """
+    :return: the number of steps between checkpoints, 0 disables them
+    """
+    return getattr(settings, 'MERLIN_CHECKPOINT_INTERVAL', 0)
+
+
+def checkpoint_steps(end: int, interval: int) -> List[int]:
+    """
+    :return: the steps before end after which a snapshot is taken
+    """
+    if interval <= 0:
+        return []
+    return list(range(interval, end, interval))
+
+
+def event_step(spec: Mapping[str, Any], event: Mapping[str, Any]) -> int:
+    """
+    :return: the simulation step an event of a scenario spec fires at
+    """
+    return event['time'] + (spec['start_offset'] or 0)
+
+
+def events_fingerprint(specs: List[Mapping[str, Any]], step: int) -> str:
+    """
+    Fingerprints the events of the ordered scenario specs that fire at or
+    before step.
+    """
+    # events of one step can come in any order, and their actions are dicts
+    # which don't compare, so order them by their canonical json
+    prefix = [
+        sorted(
+            ([event_step(spec, e), e['actions']]
+             for e in spec['events'] if event_step(spec, e) <= step),
+            key=lambda event: json.dumps(event, sort_keys=True))
+        for spec in specs]
+    return hashlib.sha1(
+        json.dumps(prefix, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def checkpoint_key(
+        sim: models.Simulation,
+        specs: List[Mapping[str, Any]],
+        step: int) -> tuple:
+    """
+    :return: the checkpoint_cache key of the snapshot after step, to be
+     looked up with the revision of sim
+    """
+    return sim.id, events_fingerprint(specs, step), step
@@ -0,0 +1,29 @@
+from django.core.checks import Warning, register
+from django.db import DatabaseError
+from . import models
+from .process_registry import process_registry
+
+# System checks, run by manage.py check and before runserver and migrate
+
+
+@register()
+def check_process_classes(app_configs, **kwargs):
+    """
+    Resolves the process class of every stored process, so classes that
+    can no longer be imported are reported at startup instead of when a
+    simulation using them is run.
+    """
+    try:
+        names = list(models.Process.objects.values_list(
+            'process_class', flat=True).distinct())
+    except DatabaseError:
+        # not migrated yet, or no database to check against
+        return []
+    return [
+        Warning(
+            'Unknown process class {0}'.format(name),
+            hint=message,
+            obj='merlin_api.Process',
+            id='merlin_api.W001')
+        for name, message in sorted(
+            process_registry.preload(names).items())]
@@ -0,0 +1,65 @@
+import hashlib
+import json
+from typing import Any, Iterable
+from django.db.models import Count, Max, Sum
+from django.utils.http import parse_etags, quote_etag
+from . import models, result_cache
+
+# Entity tags for conditional GETs of simulations and runs. Tags are made
+# from revisions only, so a matching If-None-Match can be answered with a
+# 304 without loading the simulation graph.
+
+
+def _digest(parts: Iterable[Any]) -> str:
+    return hashlib.sha1(
+        json.dumps(list(parts), sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def simulation_etag(sim_id: int, *variant: Any) -> str:
+    """
+    Tags the nested representation of a simulation. It changes with the
+    simulation revision and layout revision, and with its scenarios: their
+    number, the newest id and the sum of their revisions, which are bumped
+    by event changes.
+    :param variant: anything else the representation depends on, such as
+     the rendered format
+    :return: the tag, or None if there is no such simulation
+    """
+    try:
+        sim_id = int(sim_id)
+    except (TypeError, ValueError):
+        return None
+    row = models.Simulation.objects.filter(pk=sim_id).annotate(
+        num_scenarios=Count('scenarios'),
+        last_scenario=Max('scenarios__id'),
+        scenario_revisions=Sum('scenarios__revision'),
+    ).values_list(
+        'revision', 'layout_revision', 'num_scenarios', 'last_scenario',
+        'scenario_revisions').first()
+    if row is None:
+        return None
+    return _digest([sim_id] + list(row) + list(variant))
+
+
+def run_etag(
+        sim: models.Simulation,
+        scenarios: Iterable[models.Scenario],
+        steps: int,
+        *variant: Any) -> str:
+    """
+    Tags the telemetry of a run, which is determined by the same revisions
+    as the result cache key.
+    """
+    return _digest(
+        [result_cache.telemetry_key(sim, scenarios, steps)] + list(variant))
+
+
+def etag_matches(request, etag: str) -> bool:
+    """
+    :return: whether the If-None-Match header of request matches etag
+    """
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header or etag is None:
+        return False
+    etags = parse_etags(header)
+    return '*' in etags or etag in etags or quote_etag(etag) in etags
@@ -0,0 +1,229 @@
+from collections import defaultdict
+from typing import Any, Callable, Mapping
+from rest_framework.request import Request
+from rest_framework.reverse import reverse
+from .models import *
+
+# Read only serialization of a whole simulation straight from values()
+# rows. The output has the shape of SimulationSerializer, without building
+# a serializer field or calling reverse() per related object.
+
+_SENTINEL = 987654321
+
+
+def _url_builder(view_name: str, request: Request, format: str=None) -> \
+        Callable[[int], str]:
+    # reverse once with a placeholder pk, then splice real pks in
+    prefix, suffix = reverse(
+        view_name,
+        kwargs={'pk': _SENTINEL},
+        request=request,
+        format=format).split(str(_SENTINEL))
+    return lambda pk: None if pk is None else prefix + str(pk) + suffix
+
+
+def _pk(pk: int) -> int:
+    return pk
+
+
+def _date(value) -> str:
+    return None if value is None else value.isoformat()
+
+
+def _group(rows, key: int) -> Mapping[int, list]:
+    groups = defaultdict(list)
+    for row in rows:
+        groups[row[key]].append(row)
+    return groups
+
+
+def serialize_simulation(
+        sim: Simulation,
+        request: Request,
+        compact: bool=False,
+        format: str=None) -> Mapping[str, Any]:
+    """
+    Builds the SimulationSerializer representation of sim with one query
+    per table.
+    :param sim: The simulation to serialize
+    :param request: The request, used to build absolute hyperlinks
+    :param compact: Give related objects as ids instead of hyperlinks
+    :param format: The format suffix of the hyperlinks
+    :return: the representation, made of plain dicts and lists
+    """
+    if compact:
+        sim_url = entity_url = output_url = process_url = scenario_url = _pk
+    else:
+        sim_url = _url_builder('simulation-detail', request, format)
+        entity_url = _url_builder('entity-detail', request, format)
+        output_url = _url_builder('output-detail', request, format)
+        process_url = _url_builder('process-detail', request, format)
+        scenario_url = _url_builder('scenario-detail', request, format)
+    sim_link = sim_url(sim.id)
+
+    unittypes = UnitType.objects.filter(sim_id=sim.id).order_by('id')
+    attributes = Attribute.objects.filter(sim_id=sim.id).order_by('id')
+
+    # Entity graph
+    entities = Entity.objects.filter(sim_id=sim.id).order_by('id') \
+        .values_list(
+            'id', 'description', 'name', 'attributes', 'parent_id',
+            'is_source', 'display_pos_x', 'display_pos_y')
+    children = defaultdict(list)
+    entity_rows = list(entities)
+    for e in entity_rows:
+        if e[4] is not None:
+            children[e[4]].append(entity_url(e[0]))
+
+    endpoints = _group(
+        Endpoint.objects.filter(parent__parent__sim_id=sim.id).order_by('id')
+        .values_list(
+            'id', 'description', 'name', 'bias', 'input_id', 'parent_id',
+            'sim_output_id'),
+        5)
+    output_cons = _group(
+        OutputConnector.objects.filter(parent__sim_id=sim.id).order_by('id')
+        .values_list(
+            'id', 'description', 'name', 'parent_id', 'unit_type__value',
+            'apportion_rule'),
+        3)
+    input_cons = _group(
+        InputConnector.objects.filter(parent__sim_id=sim.id).order_by('id')
+        .values_list(
+            'id', 'description', 'name', 'parent_id', 'unit_type__value',
+            'additive_write'),
+        3)
+    properties = _group(
+        ProcessProperty.objects.filter(process__parent__sim_id=sim.id)
+        .order_by('id').values_list(
+            'id', 'description', 'name', 'default_value', 'max_value',
+            'min_value', 'process_id', 'property_type', 'readonly',
+            'property_value'),
+        6)
+    processes = _group(
+        Process.objects.filter(parent__sim_id=sim.id).order_by('id')
+        .values_list(
+            'id', 'description', 'name', 'parent_id', 'priority',
+            'process_class'),
+        3)
+
+    # Sim outputs
+    outputs = Output.objects.filter(sim_id=sim.id).order_by('id') \
+        .values_list(
+            'id', 'description', 'name', 'unit_type__value', 'attributes',
+            'minimum', 'deliver_date', 'display_pos_x', 'display_pos_y')
+    sim_output_cons = _group(
+        SimOutputConnector.objects.filter(parent__sim_id=sim.id)
+        .order_by('id').values_list(
+            'id', 'description', 'name', 'parent_id', 'unit_type__value',
+            'additive_write'),
+        3)
+
+    # Scenarios
+    scenarios = Scenario.objects.filter(sim_id=sim.id).order_by('id') \
+        .values_list('id', 'name', 'start_offset')
+    events = _group(
+        Event.objects.filter(scenario__sim_id=sim.id).order_by('id')
+        .values_list('id', 'scenario_id', 'time', 'actions'),
+        1)
+
+    return {
+        'id': sim.id,
+        'description': sim.description,
+        'name': sim.name,
+        'num_steps': sim.num_steps,
+        'start_date': _date(sim.start_date),
+        'unittypes': [
+            {'sim': sim_link, 'value': ut.value} for ut in unittypes],
+        'attributes': [
+            {'sim': sim_link, 'value': a.value} for a in attributes],
+        'entities': [{
+            'id': e[0],
+            'description': e[1],
+            'name': e[2],
+            'attributes': e[3],
+            'parent': entity_url(e[4]),
+            'sim': sim_link,
+            'is_source': e[5],
+            'children': children.get(e[0], []),
+            'outputs': [{
+                'id': o[0],
+                'description': o[1],
+                'name': o[2],
+                'parent': entity_url(o[3]),
+                'unit_type': o[4],
+                'apportion_rule': o[5],
+                'endpoints': [{
+                    'id': ep[0],
+                    'description': ep[1],
+                    'name': ep[2],
+                    'bias': ep[3],
+                    'input': ep[4],
+                    'parent': ep[5],
+                    'sim_output': ep[6],
+                } for ep in endpoints.get(o[0], [])],
+            } for o in output_cons.get(e[0], [])],
+            'inputs': [{
+                'id': i[0],
+                'description': i[1],
+                'name': i[2],
+                'parent': entity_url(i[3]),
+                'unit_type': i[4],
+                'additive_write': i[5],
+            } for i in input_cons.get(e[0], [])],
+            'processes': [{
+                'id': p[0],
+                'description': p[1],
+                'name': p[2],
+                'parent': entity_url(p[3]),
+                'priority': p[4],
+                'process_class': p[5],
+                'properties': [{
+                    'id': pp[0],
+                    'description': pp[1],
+                    'name': pp[2],
+                    'default_value': pp[3],
+                    'max_value': pp[4],
+                    'min_value': pp[5],
+                    'process': process_url(pp[6]),
+                    'property_type': pp[7],
+                    'readonly': pp[8],
+                    'property_value': pp[9],
+                } for pp in properties.get(p[0], [])],
+            } for p in processes.get(e[0], [])],
+            'display_pos_x': e[6],
+            'display_pos_y': e[7],
+        } for e in entity_rows],
+        'outputs': [{
+            'id': o[0],
+            'description': o[1],
+            'name': o[2],
+            'sim': sim_link,
+            'unit_type': o[3],
+            'attributes': o[4],
+            'minimum': o[5],
+            'inputs': [{
+                'id': i[0],
+                'description': i[1],
+                'name': i[2],
+                'parent': output_url(i[3]),
+                'unit_type': i[4],
+                'additive_write': i[5],
+            } for i in sim_output_cons.get(o[0], [])],
+            'deliver_date': _date(o[6]),
+            'display_pos_x': o[7],
+            'display_pos_y': o[8],
+        } for o in outputs],
+        'scenarios': [{
+            'id': s[0],
+            'name': s[1],
+            'sim': sim_link,
+            'start_offset': s[2],
+            'events': [{
+                'id': ev[0],
+                'scenario': scenario_url(ev[1]),
+                'time': ev[2],
+                'actions': ev[3],
+            } for ev in events.get(s[0], [])],
+        } for s in scenarios],
+    }
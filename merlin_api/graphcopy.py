@@ -0,0 +1,140 @@
+import copyreg
+import types
+import weakref
+from typing import Any, Generator
+
+# A deep copy of object graphs that doesn't recurse. copy.deepcopy follows
+# every reference on the python stack, and a merlin simulation links
+# entities to each other through connectors and endpoints, so on large
+# models the chains are longer than the recursion limit. copy_graph gives
+# the same result, but keeps the objects still to be copied on a list.
+
+_ATOMIC = frozenset([
+    type(None), type(Ellipsis), type(NotImplemented), int, float, bool,
+    complex, bytes, str, type, range, property, types.FunctionType,
+    types.BuiltinFunctionType, types.CodeType, weakref.ref])
+
+# yields the objects it needs copies of, is sent each copy, returns its own
+_Copier = Generator[Any, Any, Any]
+
+
+def copy_graph(root: Any) -> Any:
+    """
+    Deep copies root like copy.deepcopy, for graphs of any depth.
+    """
+    memo = dict()
+    keep = list()
+    stack = [_copy(root, memo, keep)]
+    value = None
+    while stack:
+        try:
+            child = stack[-1].send(value)
+        except StopIteration as done:
+            stack.pop()
+            value = done.value
+            continue
+        if type(child) in _ATOMIC:
+            value = child
+        elif id(child) in memo:
+            value = memo[id(child)]
+        else:
+            stack.append(_copy(child, memo, keep))
+            value = None
+    return value
+
+
+def _remember(x: Any, y: Any, memo: dict, keep: list) -> None:
+    memo[id(x)] = y
+    # temporaries such as reduced state must outlive the copy, or their
+    # ids could be reused by other objects
+    keep.append(x)
+
+
+def _copy(x: Any, memo: dict, keep: list) -> _Copier:
+    if id(x) in memo:
+        return memo[id(x)]
+    cls = type(x)
+    if cls in _ATOMIC or issubclass(cls, type):
+        return x
+
+    if cls is types.MethodType:
+        y = types.MethodType(x.__func__, (yield x.__self__))
+        _remember(x, y, memo, keep)
+        return y
+    if cls is list:
+        y = list()
+        _remember(x, y, memo, keep)
+        for item in x:
+            y.append((yield item))
+        return y
+    if cls is dict:
+        y = dict()
+        _remember(x, y, memo, keep)
+        for key, item in x.items():
+            key = yield key
+            y[key] = yield item
+        return y
+    if cls is set:
+        y = set()
+        _remember(x, y, memo, keep)
+        for item in x:
+            y.add((yield item))
+        return y
+    if cls is tuple:
+        items = list()
+        for item in x:
+            items.append((yield item))
+        # a cycle back to x may have copied it in the meantime
+        if id(x) in memo:
+            return memo[id(x)]
+        y = x if all(a is b for a, b in zip(items, x)) else tuple(items)
+        _remember(x, y, memo, keep)
+        return y
+
+    deep_copier = getattr(x, '__deepcopy__', None)
+    if deep_copier is not None and not isinstance(x, type):
+        # leaf types like enums and arrays, their copies don't nest
+        y = deep_copier(memo)
+        _remember(x, y, memo, keep)
+        return y
+
+    reductor = copyreg.dispatch_table.get(cls)
+    if reductor is not None:
+        rv = reductor(x)
+    else:
+        rv = x.__reduce_ex__(4)
+    if isinstance(rv, str):
+        return x
+    return (yield from _reconstruct(x, memo, keep, *rv))
+
+
+def _reconstruct(x: Any, memo: dict, keep: list, func, args, state=None,
+                 listiter=None, dictiter=None, *unused) -> _Copier:
+    copied_args = list()
+    for arg in args:
+        copied_args.append((yield arg))
+    y = func(*copied_args)
+    _remember(x, y, memo, keep)
+
+    if state is not None:
+        state = yield state
+        if hasattr(y, '__setstate__'):
+            y.__setstate__(state)
+        else:
+            slotstate = None
+            if isinstance(state, tuple) and len(state) == 2:
+                state, slotstate = state
+            if state:
+                y.__dict__.update(state)
+            if slotstate:
+                for key, value in slotstate.items():
+                    setattr(y, key, value)
+    if listiter is not None:
+        for item in listiter:
+            y.append((yield item))
+    if dictiter is not None:
+        for key, value in dictiter:
+            key = yield key
+            y[key] = yield value
+    return y
+
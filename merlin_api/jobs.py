@@ -0,0 +1,146 @@
+import logging
+import time
+from datetime import timedelta
+from django.db import connection, close_old_connections
+from django.utils import timezone
+from . import bulk, models, pymerlin_adapter
+
+logger = logging.getLogger('merlin_api.jobs')
+
+# Background execution of queued simulation jobs. Any number of workers can
+# poll the job table, SKIP LOCKED guarantees each job is claimed only once.
+
+CLAIM_SQL = """
+    UPDATE {table} SET status = %s, started = %s
+    WHERE id = (
+        SELECT id FROM {table}
+        WHERE status = %s
+        ORDER BY id
+        FOR UPDATE SKIP LOCKED
+        LIMIT 1)
+    RETURNING id
+"""
+
+
+def claim_next_job() -> models.SimulationJob:
+    """
+    Atomically marks the oldest pending job as running.
+    :return: the claimed job, or None if there is nothing to do
+    """
+    sql = CLAIM_SQL.format(
+        table=connection.ops.quote_name(models.SimulationJob._meta.db_table))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            sql,
+            [models.SimulationJob.RUNNING,
+             timezone.now(),
+             models.SimulationJob.PENDING])
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    return models.SimulationJob.objects.select_related('sim').get(pk=row[0])
+
+
+def execute_job(job: models.SimulationJob) -> None:
+    """
+    Runs a claimed job and records its result.
+    """
+    if job.kind == models.SimulationJob.DELETE:
+        execute_delete_job(job)
+        return
+    try:
+        scenarios = models.Scenario.objects.prefetch_related(
+            'events').in_bulk(job.scenarios)
+        scenarios = [scenarios[s_id] for s_id in job.scenarios]
+        result, duration = pymerlin_adapter.run_simulation_timed(
+            job.sim,
+            scenarios=scenarios,
+            steps=job.steps)
+        if isinstance(result, dict):
+            # scenario conversion errors are reported as a dict
+            job.status = models.SimulationJob.FAILED
+            job.result = result
+        else:
+            job.status = models.SimulationJob.DONE
+            job.run = pymerlin_adapter.save_simulation_run(
+                job.sim,
+                scenarios,
+                job.steps,
+                result,
+                duration=duration)
+    except Exception as e:
+        logger.exception('simulation job {0} failed'.format(job.id))
+        job.status = models.SimulationJob.FAILED
+        job.result = {'message': [str(e)]}
+    job.finished = timezone.now()
+    job.save(update_fields=['status', 'result', 'run', 'finished'])
+
+
+def execute_delete_job(job: models.SimulationJob) -> None:
+    """
+    Deletes the simulation of a claimed deletion job, the job is kept with
+    the deleted row counts as its result.
+    """
+    sim_id = job.sim_id
+    try:
+        job.result = {
+            'sim': sim_id,
+            'deleted': bulk.delete_simulation(sim_id) if sim_id else {}}
+        job.status = models.SimulationJob.DONE
+    except Exception as e:
+        logger.exception('deletion job {0} failed'.format(job.id))
+        job.status = models.SimulationJob.FAILED
+        job.result = {'message': [str(e)]}
+    job.finished = timezone.now()
+    job.save(update_fields=['status', 'result', 'finished'])
+
+
+def requeue_stale_jobs(timeout: float) -> int:
+    """
+    Puts jobs that have been running for more than timeout seconds back in
+    the queue. Those were claimed by a worker that crashed or was killed.
+    :return: the number of jobs requeued
+    """
+    requeued = models.SimulationJob.objects.filter(
+        status=models.SimulationJob.RUNNING,
+        started__lt=timezone.now() - timedelta(seconds=timeout)).update(
+            status=models.SimulationJob.PENDING,
+            started=None)
+    if requeued:
+        logger.warning('requeued {0} stale simulation jobs'.format(requeued))
+    return requeued
+
+
+def run_worker(
+        poll_interval: float=1.0,
+        once: bool=False,
+        job_timeout: float=None) -> int:
+    """
+    Processes jobs until interrupted, sleeping poll_interval seconds
+    whenever the queue is empty.
+    :param once: return as soon as the queue is empty
+    :param job_timeout: requeue jobs running for longer than this many
+     seconds, None never requeues
+    :return: the number of jobs processed
+    """
+    processed = 0
+    while True:
+        close_old_connections()
+        if job_timeout is not None:
+            requeue_stale_jobs(job_timeout)
+        job = claim_next_job()
+        if job is None:
+            if once:
+                return processed
+            time.sleep(poll_interval)
+            continue
+        logger.info('running simulation job {0}'.format(job.id))
+        try:
+            execute_job(job)
+        except Exception:
+            # e.g. the database went away while recording the result, the
+            # job stays running until it is requeued
+            logger.exception(
+                'could not record the result of simulation job {0}'.format(
+                    job.id))
+        processed += 1
@@ -1,5 +1,5 @@
 from django.core.management.base import BaseCommand, CommandError
-from merlin_api import pymerlin_adapter, tests
+from merlin_api import bulk, tests
 import pymerlin
 import importlib
 
@@ -8,6 +8,11 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('module_name', nargs='+', type=str)
+        parser.add_argument(
+            '--copy',
+            action='store_true',
+            default=None,
+            help='always import with COPY, by default it is only used for large models')
 
     def handle(self, *args, **options):
         for module_name in options['module_name']:
@@ -35,5 +40,5 @@ class Command(BaseCommand):
             if not isinstance(sim, pymerlin.merlin.Simulation):
                 raise ValueError("unexpected return type")
 
-            theId = pymerlin_adapter.pymerlin2django(sim)
+            theId = bulk.import_simulation(sim, use_copy=options['copy'])
             self.stdout.write(self.style.SUCCESS('Successfully added "%s as %d"' % (module_name, theId)))
@@ -0,0 +1,224 @@
+import json
+import platform
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from merlin_api import bulk, pymerlin_adapter, synthetic
+from merlin_api.fast_serializers import serialize_simulation
+from merlin_api.models import Scenario, Simulation
+from merlin_api.renderers import ORJSONRenderer
+from merlin_api.serializers import (
+    SimulationSerializer, get_prefetch_lookups)
+from merlin_api.telemetry import compress_telemetry, encode_telemetry
+
+
+def timed(func, repeat: int, setup=None):
+    """
+    :param setup: called untimed before each call, func is passed its
+     result
+    :return: the fastest of repeat calls of func in seconds, and the result
+     of the last call
+    """
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        args = () if setup is None else (setup(),)
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def time_hydration(sim_id: int, repeat: int):
+    """
+    Times loading the prefetched graph of a simulation and django2pymerlin
+    separately.
+    :return: the fastest load and hydration of repeat runs in seconds, and
+     the last hydrated simulation
+    """
+    load = hydrate = float('inf')
+    msim = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        sim = Simulation.objects.prefetch_related(
+            *pymerlin_adapter.SIMULATION_GRAPH_PREFETCH).get(pk=sim_id)
+        loaded = time.perf_counter()
+        msim = pymerlin_adapter.django2pymerlin(sim)
+        done = time.perf_counter()
+        load = min(load, loaded - start)
+        hydrate = min(hydrate, done - loaded)
+    return load, hydrate, msim
+
+
+class Command(BaseCommand):
+
+    help = ('Builds a synthetic model and times each stage of the ' +
+            'pipeline: import, hydration, running, telemetry encoding ' +
+            'and the nested simulation GET. With --scaling hydration is ' +
+            'also timed at increasing model sizes, to check that it ' +
+            'scales linearly. Results are written as json')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entities', type=int, default=1000)
+        parser.add_argument('--fan-out', type=int, default=2)
+        parser.add_argument('--fan-in', type=int, default=0)
+        parser.add_argument('--depth', type=int, default=0)
+        parser.add_argument('--processes', type=int, default=1,
+                            help='processes per entity')
+        parser.add_argument('--outputs', type=int, default=1)
+        parser.add_argument('--steps', type=int, default=10)
+        parser.add_argument('--scenarios', type=int, default=1)
+        parser.add_argument('--events', type=int, default=10,
+                            help='events per scenario')
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--skip-row-import', action='store_true',
+            help='do not time the row by row pymerlin2django import')
+        parser.add_argument(
+            '--scaling', nargs='+', type=int, default=[],
+            help='entity counts to time hydration at, e.g. 100 1000 20000')
+        parser.add_argument(
+            '--output', help='write the results to this file, not stdout')
+
+    def handle(self, *args, **options):
+        if options['scenarios'] and not options['processes']:
+            raise CommandError('scenario events need --processes > 0')
+        repeat = options['repeat']
+        params = {
+            k: options[k] for k in (
+                'entities', 'fan_out', 'fan_in', 'depth', 'processes',
+                'outputs', 'steps', 'scenarios', 'events', 'repeat', 'seed')}
+        timings = dict()
+        sizes = dict()
+        queries = dict()
+
+        timings['generate_s'], msim = timed(
+            lambda: synthetic.create_synthetic_simulation(
+                options['entities'],
+                fan_out=options['fan_out'],
+                fan_in=options['fan_in'],
+                depth=options['depth'],
+                processes_per_entity=options['processes'],
+                num_outputs=options['outputs'],
+                num_steps=options['steps'],
+                seed=options['seed']),
+            1)
+
+        if not options['skip_row_import']:
+            timings['pymerlin2django_s'], sim_id = timed(
+                lambda: pymerlin_adapter.pymerlin2django(msim), 1)
+            pymerlin_adapter.delete_django_sim(sim_id)
+
+        timings['bulk_import_s'], sim_id = timed(
+            lambda: bulk.import_simulation(msim), 1)
+        try:
+            with CaptureQueriesContext(connection) as ctx:
+                timings['graph_load_s'], timings['django2pymerlin_s'], \
+                    hydrated = time_hydration(sim_id, repeat)
+            queries['django2pymerlin'] = len(ctx.captured_queries) // repeat
+
+            dsim = Simulation.objects.get(pk=sim_id)
+            for s in synthetic.create_synthetic_scenarios(
+                    hydrated,
+                    options['scenarios'],
+                    options['events'],
+                    seed=options['seed']):
+                pymerlin_adapter.pymerlin_scenario2django(s, dsim)
+            dscenarios = list(
+                Scenario.objects.filter(sim=dsim).prefetch_related('events'))
+
+            # every run gets a fresh graph, hydrated outside the timing
+            spec = pymerlin_adapter.django2spec(
+                Simulation.objects.prefetch_related(
+                    *pymerlin_adapter.SIMULATION_GRAPH_PREFETCH).get(
+                        pk=sim_id))
+
+            def run(m):
+                m_scenarios = [
+                    pymerlin_adapter.django_scenario2pymerlin(ds, m)
+                    for ds in dscenarios]
+                m.run(scenarios=m_scenarios, end=options['steps'])
+                return m.get_sim_telemetry()
+
+            timings['run_s'], telemetry = timed(
+                run, repeat,
+                setup=lambda: pymerlin_adapter.spec2pymerlin(spec))
+
+            timings['telemetry_json_s'], encoded = timed(
+                lambda: json.dumps(telemetry).encode('utf-8'), repeat)
+            sizes['telemetry_json_bytes'] = len(encoded)
+            timings['telemetry_binary_s'], encoded = timed(
+                lambda: encode_telemetry(telemetry), repeat)
+            sizes['telemetry_binary_bytes'] = len(encoded)
+            timings['telemetry_compress_s'], encoded = timed(
+                lambda: compress_telemetry(telemetry), repeat)
+            sizes['telemetry_compressed_bytes'] = len(encoded)
+
+            request = Request(APIRequestFactory().get(
+                '/api/simulations/{0}/'.format(sim_id)))
+
+            def get():
+                sim = Simulation.objects.prefetch_related(
+                    *get_prefetch_lookups(SimulationSerializer)).get(
+                        pk=sim_id)
+                return JSONRenderer().render(SimulationSerializer(
+                    sim, context={'request': request}).data)
+
+            with CaptureQueriesContext(connection) as ctx:
+                timings['simulation_get_s'], body = timed(get, repeat)
+            queries['simulation_get'] = len(ctx.captured_queries) // repeat
+            sizes['simulation_get_bytes'] = len(body)
+
+            def get_fast():
+                sim = Simulation.objects.get(pk=sim_id)
+                return ORJSONRenderer().render(
+                    serialize_simulation(sim, request))
+
+            with CaptureQueriesContext(connection) as ctx:
+                timings['simulation_get_fast_s'], body = timed(
+                    get_fast, repeat)
+            queries['simulation_get_fast'] = \
+                len(ctx.captured_queries) // repeat
+            sizes['simulation_get_fast_bytes'] = len(body)
+        finally:
+            pymerlin_adapter.delete_django_sim(sim_id)
+
+        scaling = list()
+        for size in options['scaling']:
+            sim_id = bulk.import_simulation(
+                synthetic.create_synthetic_simulation(
+                    size,
+                    fan_out=options['fan_out'],
+                    seed=options['seed']))
+            try:
+                load, hydrate, _ = time_hydration(sim_id, repeat)
+            finally:
+                pymerlin_adapter.delete_django_sim(sim_id)
+            scaling.append({
+                'entities': size,
+                'graph_load_s': load,
+                'django2pymerlin_s': hydrate,
+                'django2pymerlin_us_per_entity': hydrate / size * 1e6,
+            })
+
+        results = {
+            'created': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'params': params,
+            'timings': timings,
+            'queries': queries,
+            'sizes': sizes,
+            'scaling': scaling,
+        }
+        out = json.dumps(results, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(out)
+        else:
+            self.stdout.write(out)
@@ -1,6 +1,7 @@
 import json
 import argparse
 from django.core.management.base import BaseCommand, CommandError
+from merlin_api import bulk
 from merlin_api.models import Simulation
 
 
@@ -28,7 +29,8 @@ class Command(BaseCommand):
             raise CommandError(
                 'There was an error loading the data from the file')
 
-        for e in sim.entities.all():
+        entities = list()
+        for e in sim.entities.select_related('parent'):
             # Try to find matching positional info
             for pos_data in data:
                 if 'parent' in pos_data:
@@ -39,17 +41,20 @@ class Command(BaseCommand):
                         parent_match = (pos_data['parent'] == e.parent.name)
 
                     if name_match and parent_match:
-                        e.display_pos_x = pos_data['x']
-                        e.display_pos_y = pos_data['y']
-                        e.save()
+                        entities.append({
+                            'id': e.id,
+                            'x': pos_data['x'],
+                            'y': pos_data['y']})
 
+        outputs = list()
         for o in sim.outputs.all():
             for pos_data in data:
                 name_match = (pos_data['name'] == o.name)
                 if name_match:
-                    o.display_pos_x = pos_data['x']
-                    o.display_pos_y = pos_data['y']
-                    o.save()
+                    outputs.append(
+                        {'id': o.id, 'x': pos_data['x'], 'y': pos_data['y']})
+
+        bulk.update_layout(sim.id, entities=entities, outputs=outputs)
 
         self.stdout.write(
             self.style.SUCCESS(
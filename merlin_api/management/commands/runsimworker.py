@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from merlin_api import jobs
+from merlin_api.models import Process
+from merlin_api.process_registry import process_registry
+
+
+class Command(BaseCommand):
+
+    help = 'Runs queued simulation jobs until interrupted'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--poll',
+            type=float,
+            default=getattr(settings, 'MERLIN_WORKER_POLL_INTERVAL', 1.0),
+            help='seconds to wait between polls of an empty queue')
+        parser.add_argument(
+            '--job-timeout',
+            type=float,
+            default=getattr(settings, 'MERLIN_JOB_TIMEOUT', None),
+            help='requeue jobs that have been running for more than this '
+                 'many seconds, e.g. after a worker was killed')
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='exit as soon as the queue is empty')
+
+    def handle(self, *args, **options):
+        # report unknown process classes now rather than in a failed job
+        unknown = process_registry.preload(
+            Process.objects.values_list('process_class', flat=True).distinct())
+        for name, message in sorted(unknown.items()):
+            self.stderr.write(message)
+        try:
+            processed = jobs.run_worker(
+                poll_interval=options['poll'],
+                once=options['once'],
+                job_timeout=options['job_timeout'])
+        except KeyboardInterrupt:
+            return
+        self.stdout.write(
+            self.style.SUCCESS('Processed {0} jobs'.format(processed)))
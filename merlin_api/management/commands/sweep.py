@@ -0,0 +1,88 @@
+import argparse
+import json
+from django.core.management.base import BaseCommand, CommandError
+from merlin_api import pymerlin_adapter
+from merlin_api.models import Simulation, Scenario
+
+
+def property_values(arg):
+    """
+    Parses a PROPERTY_ID=V1,V2,... argument
+    """
+    try:
+        pp_id, values = arg.split('=', 1)
+        return int(pp_id), [float(v) for v in values.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'expected PROPERTY_ID=V1,V2,... got {0}'.format(arg))
+
+
+class Command(BaseCommand):
+
+    help = ('Runs a simulation for every combination of the supplied ' +
+            'process property values and writes the result cube as json')
+
+    def add_arguments(self, parser):
+        parser.add_argument('simulation_id', type=int)
+        parser.add_argument(
+            '--set',
+            dest='grid',
+            type=property_values,
+            action='append',
+            default=[],
+            metavar='PROPERTY_ID=V1,V2,...',
+            help='values to sweep for a process property')
+        parser.add_argument(
+            '--variants',
+            type=argparse.FileType('r'),
+            help='json file holding a list of {property id: value} dicts')
+        parser.add_argument(
+            '--scenario', dest='scenarios', type=int, action='append',
+            default=[])
+        parser.add_argument('--steps', type=int, default=-1)
+        parser.add_argument(
+            '--output', type=argparse.FileType('w'), default='-')
+
+    def handle(self, *args, **options):
+        try:
+            sim = Simulation.objects.get(pk=options['simulation_id'])
+        except Simulation.DoesNotExist:
+            raise CommandError(
+                'There is no simulation with id {0} in the database'.format(
+                    options['simulation_id']))
+
+        if options['variants']:
+            try:
+                overrides = [
+                    {int(k): float(v) for k, v in o.items()}
+                    for o in json.load(options['variants'])]
+            except (ValueError, AttributeError):
+                raise CommandError(
+                    'There was an error loading the variants file')
+        elif options['grid']:
+            overrides = pymerlin_adapter.expand_property_grid(
+                dict(options['grid']))
+        else:
+            raise CommandError('Supply --set or --variants')
+
+        scenarios = Scenario.objects.filter(
+            sim=sim).prefetch_related('events').in_bulk(options['scenarios'])
+        missing = set(options['scenarios']) - set(scenarios)
+        if missing:
+            raise CommandError(
+                'Unknown scenarios for this simulation: {0}'.format(
+                    sorted(missing)))
+
+        try:
+            cube = pymerlin_adapter.sweep_simulation(
+                sim,
+                overrides,
+                scenarios=[scenarios[s_id] for s_id in options['scenarios']],
+                steps=options['steps'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        json.dump(cube, options['output'])
+        self.stderr.write(
+            self.style.SUCCESS(
+                'Swept {0} variants'.format(len(overrides))))
@@ -0,0 +1,97 @@
+import json
+import logging
+import re
+from collections import Counter
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger('merlin_api.queries')
+
+# Literals are stripped from logged sql so repeats of the same statement
+# with different parameters, the signature of an N+1 pattern, group up.
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+def normalize_sql(sql: str) -> str:
+    return _LITERALS.sub('?', sql)
+
+
+class QueryProfileMiddleware:
+    """
+    Records the queries issued while handling each request, without
+    needing DEBUG. The query count, total database time and the worst
+    duplicated statement are added as X-Query-* response headers, and a
+    structured log line lists the slowest and most duplicated statements.
+
+    Settings:
+        MERLIN_QUERY_PROFILE: enables the middleware, by default only with
+            DEBUG since every statement of a request is kept in memory
+        MERLIN_QUERY_PROFILE_TOP_N: statements listed in the log line
+        MERLIN_QUERY_DUPLICATE_THRESHOLD: repeats of one statement that flag
+            an N+1 pattern and raise the log line to a warning
+
+    Streaming responses are profiled when they are returned, before their
+    body is generated, so queries made while the body streams (e.g. the
+    ndjson telemetry) are not counted. Their log line has streaming set.
+    """
+
+    def __init__(self):
+        if not getattr(settings, 'MERLIN_QUERY_PROFILE', settings.DEBUG):
+            raise MiddlewareNotUsed()
+
+    def process_request(self, request):
+        request._query_profile_debug = dict()
+        for conn in connections.all():
+            request._query_profile_debug[conn.alias] = conn.force_debug_cursor
+            conn.force_debug_cursor = True
+            conn.queries_log.clear()
+
+    def process_response(self, request, response):
+        previous = getattr(request, '_query_profile_debug', None)
+        if previous is None:
+            return response
+
+        queries = list()
+        for conn in connections.all():
+            queries.extend(conn.queries_log)
+            if conn.alias in previous:
+                conn.force_debug_cursor = previous[conn.alias]
+
+        top_n = getattr(settings, 'MERLIN_QUERY_PROFILE_TOP_N', 5)
+        threshold = getattr(
+            settings, 'MERLIN_QUERY_DUPLICATE_THRESHOLD', 10)
+
+        total_time = sum(float(q['time']) for q in queries)
+        duplicates = Counter(normalize_sql(q['sql']) for q in queries)
+        worst = duplicates.most_common(1)[0][1] if duplicates else 0
+
+        response['X-Query-Count'] = str(len(queries))
+        response['X-Query-Time'] = '{0:.1f}'.format(total_time * 1000)
+        response['X-Query-Duplicates'] = str(worst)
+
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'streaming': response.streaming,
+            'queries': len(queries),
+            'db_time_ms': round(total_time * 1000, 1),
+            'slowest': [
+                {'time_ms': round(float(q['time']) * 1000, 1),
+                 'sql': q['sql'][:500]}
+                for q in sorted(
+                    queries,
+                    key=lambda q: float(q['time']),
+                    reverse=True)[:top_n]],
+            'duplicated': [
+                {'count': count, 'sql': sql[:500]}
+                for sql, count in duplicates.most_common(top_n)
+                if count > 1],
+        }
+        if worst >= threshold:
+            record['n_plus_one'] = True
+            logger.warning(json.dumps(record))
+        else:
+            logger.info(json.dumps(record))
+        return response
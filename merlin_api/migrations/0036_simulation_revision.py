@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('merlin_api', '0035_projectphase_capitalization'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='simulation',
+            name='revision',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
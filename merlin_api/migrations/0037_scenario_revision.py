@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('merlin_api', '0036_simulation_revision'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scenario',
+            name='revision',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
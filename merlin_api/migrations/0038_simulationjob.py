@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('merlin_api', '0037_scenario_revision'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimulationJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scenarios', django.contrib.postgres.fields.ArrayField(base_field=models.PositiveIntegerField(), default=[], size=None)),
+                ('steps', models.IntegerField(default=-1)),
+                ('status', models.PositiveIntegerField(choices=[(1, 'pending'), (2, 'running'), (3, 'done'), (4, 'failed')], db_index=True, default=1)),
+                ('result', django.contrib.postgres.fields.jsonb.JSONField(null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(null=True)),
+                ('finished', models.DateTimeField(null=True)),
+                ('sim', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='merlin_api.Simulation')),
+            ],
+        ),
+    ]
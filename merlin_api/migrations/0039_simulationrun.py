@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('merlin_api', '0038_simulationjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimulationRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('revision', models.PositiveIntegerField()),
+                ('scenarios', django.contrib.postgres.fields.ArrayField(base_field=models.PositiveIntegerField(), default=[], size=None)),
+                ('steps', models.IntegerField(default=-1)),
+                ('duration', models.FloatField(null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('telemetry', models.BinaryField()),
+                ('sim', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='runs', to='merlin_api.Simulation')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='simulationjob',
+            name='run',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='merlin_api.SimulationRun'),
+        ),
+    ]
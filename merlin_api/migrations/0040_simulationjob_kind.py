@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('merlin_api', '0039_simulationrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='simulationjob',
+            name='kind',
+            field=models.PositiveIntegerField(choices=[(1, 'run'), (2, 'delete')], default=1),
+        ),
+        migrations.AlterField(
+            model_name='simulationjob',
+            name='sim',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='jobs', to='merlin_api.Simulation'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('merlin_api', '0040_simulationjob_kind'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='simulation',
+            name='layout_revision',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
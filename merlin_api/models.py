@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import F
 from django.contrib.postgres.fields import ArrayField, JSONField
 import datetime
 
@@ -12,8 +13,49 @@ class SimObject(models.Model):
     description = models.CharField(max_length=255, default="", null=True)
 
 
-class Simulation(SimObject):
+class Revisioned(models.Model):
+    """
+    A model carrying a content revision that is bumped whenever the rows
+    it is made of change.
+    """
+
+    class Meta:
+        abstract = True
+
+    # fields that are only written through bump_revision
+    REVISION_FIELDS = ('revision',)
+
+    revision = models.PositiveIntegerField(default=0)
+
+    def save(self, *args, **kwargs):
+        # revision is only ever written through bump_revision, so a save
+        # from a stale instance can't roll it back. Instances that weren't
+        # loaded from the database keep the insert fallback of a plain save
+        if (not self._state.adding and
+                not kwargs.get('force_insert') and
+                kwargs.get('update_fields') is None):
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.REVISION_FIELDS]
+        super(Revisioned, self).save(*args, **kwargs)
+
+    @classmethod
+    def bump_revision(cls, pk: int, field: str='revision') -> None:
+        """
+        Increments the revision of the row with this pk. This is done as a
+        single UPDATE so concurrent writers never lose a bump.
+        :param field: the revision field to bump
+        """
+        cls.objects.filter(pk=pk).update(**{field: F(field) + 1})
+
+
+class Simulation(SimObject, Revisioned):
+    REVISION_FIELDS = ('revision', 'layout_revision')
+
     num_steps = models.PositiveIntegerField(default=1)
+    # bumped instead of revision when only display positions change, those
+    # don't affect the hydrated graph or its runs
+    layout_revision = models.PositiveIntegerField(default=0)
     start_date = models.DateField(default=datetime.datetime(2016, 7, 1))
 
 
@@ -226,7 +268,7 @@ class ProcessProperty(SimObject):
 
 
 
-class Scenario(SimObject):
+class Scenario(SimObject, Revisioned):
     sim = models.ForeignKey(
         Simulation,
         on_delete=models.CASCADE,
@@ -274,3 +316,60 @@ class ProjectPhase(SimObject):
     end_date = models.DateField(default=datetime.datetime(2016, 4, 1))
     is_active = models.BooleanField(default=True)
     capitalization = models.FloatField(default=0.0)
+
+
+class SimulationRun(models.Model):
+    """
+    The stored result of a simulation run. Telemetry is kept as zlib
+    compressed columnar binary, see merlin_api.telemetry.
+    """
+    sim = models.ForeignKey(
+        Simulation, on_delete=models.CASCADE, related_name='runs')
+    revision = models.PositiveIntegerField()
+    scenarios = ArrayField(models.PositiveIntegerField(), default=[])
+    steps = models.IntegerField(default=-1)
+    duration = models.FloatField(null=True)
+    created = models.DateTimeField(auto_now_add=True)
+    telemetry = models.BinaryField()
+
+
+class SimulationJob(models.Model):
+    """
+    A simulation run, or the deletion of a simulation, queued for a
+    background worker. Deletion jobs outlive their simulation, their sim
+    is set to null once it is gone.
+    """
+
+    RUN = 1
+    DELETE = 2
+
+    JOB_KIND = (
+        (RUN, 'run'),
+        (DELETE, 'delete')
+    )
+
+    PENDING = 1
+    RUNNING = 2
+    DONE = 3
+    FAILED = 4
+
+    JOB_STATUS = (
+        (PENDING, 'pending'),
+        (RUNNING, 'running'),
+        (DONE, 'done'),
+        (FAILED, 'failed')
+    )
+
+    kind = models.PositiveIntegerField(choices=JOB_KIND, default=RUN)
+    sim = models.ForeignKey(
+        Simulation, null=True, on_delete=models.SET_NULL, related_name='jobs')
+    scenarios = ArrayField(models.PositiveIntegerField(), default=[])
+    steps = models.IntegerField(default=-1)
+    status = models.PositiveIntegerField(
+        choices=JOB_STATUS, default=PENDING, db_index=True)
+    result = JSONField(null=True)
+    run = models.ForeignKey(
+        SimulationRun, null=True, on_delete=models.SET_NULL)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True)
+    finished = models.DateTimeField(null=True)
@@ -0,0 +1,48 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+# Pagination of list endpoints
+
+
+class SimulationPagination(PageNumberPagination):
+    """
+    Pages of simulation summaries, the page size can be chosen with
+    page_size up to max_page_size.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+class OptionalCursorPagination(CursorPagination):
+    """
+    Keyset pagination by id that is off unless the request asks for it
+    with cursor or page_size, so plain list requests keep returning every
+    object as a bare list.
+    """
+    ordering = 'id'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.__class__.page_size
+        if page_size <= 0:
+            return self.__class__.page_size
+        return min(page_size, self.max_page_size)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if (self.cursor_query_param not in request.query_params and
+                self.page_size_query_param not in request.query_params):
+            return None
+        self.page_size = self.get_page_size(request)
+        return super().paginate_queryset(queryset, request, view)
+
+
+class RunPagination(OptionalCursorPagination):
+    """
+    Optional keyset pagination of stored runs, newest first.
+    """
+    ordering = '-created'
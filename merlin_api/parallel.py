@@ -0,0 +1,97 @@
+import multiprocessing
+import os
+import pickle
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, List, Sequence
+from django.conf import settings
+
+# Fans work on a hydrated simulation out to a pool of worker processes.
+# Each web worker process has a single long-lived pool, started lazily on
+# first use. Its processes come from a forkserver rather than from a fork
+# of the (multi-threaded) web worker, so they don't inherit locks held by
+# other threads or the open database connection. The shared object is
+# pickled once per call and every task unpickles its own copy, so it should
+# be plain data, e.g. a simulation spec that tasks hydrate themselves,
+# rather than a merlin graph.
+
+_pool = None
+_pool_lock = threading.Lock()
+_batches = None
+
+
+def _init_worker():
+    # the task functions live in modules that import the django models
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+def _call(func: Callable[[Any, Any], Any], shared: bytes, args: Any) -> Any:
+    return func(pickle.loads(shared), args)
+
+
+def get_max_workers() -> int:
+    return getattr(settings, 'MERLIN_MAX_WORKERS', None) or os.cpu_count()
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """
+    :return: the worker pool of this process, started on first use
+    """
+    global _pool, _batches
+    with _pool_lock:
+        if _pool is None:
+            context = multiprocessing.get_context('forkserver')
+            # under uwsgi sys.executable is the uwsgi binary
+            executable = getattr(settings, 'MERLIN_WORKER_PYTHON', None)
+            if executable:
+                context.set_executable(executable)
+            _pool = ProcessPoolExecutor(
+                max_workers=get_max_workers(),
+                mp_context=context,
+                initializer=_init_worker)
+            _batches = threading.BoundedSemaphore(
+                getattr(settings, 'MERLIN_MAX_PARALLEL_BATCHES', 2))
+        return _pool
+
+
+def reset_pool(pool: ProcessPoolExecutor):
+    """
+    Drops pool if it is still the pool of this process, e.g. after one of
+    its workers died, so the next call starts a new one.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def map_parallel(
+        func: Callable[[Any, Any], Any],
+        shared: Any,
+        args_list: Sequence[Any]) -> List[Any]:
+    """
+    Calls func(shared, args) for each entry of args_list in the worker
+    pool and returns the results in order. func must be a module level
+    function, and shared, args and the results must be picklable.
+    At most MERLIN_MAX_PARALLEL_BATCHES calls per process use the pool at
+    the same time, further calls wait for one of them to finish.
+    :param shared: Data passed to every call, func must not mutate it
+    """
+    if len(args_list) <= 1 or get_max_workers() <= 1:
+        return [func(shared, args) for args in args_list]
+
+    pool = get_pool()
+    data = pickle.dumps(shared, pickle.HIGHEST_PROTOCOL)
+    with _batches:
+        try:
+            futures = [
+                pool.submit(_call, func, data, args) for args in args_list]
+            return [f.result() for f in futures]
+        except BrokenProcessPool:
+            reset_pool(pool)
+            raise
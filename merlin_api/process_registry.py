@@ -0,0 +1,178 @@
+import importlib
+import inspect
+import logging
+import threading
+from typing import Any, Iterable, Mapping
+from django.conf import settings
+from pymerlin import merlin
+
+logger = logging.getLogger('merlin_api.process_registry')
+
+# Resolved merlin.Process subclasses by the process_class strings stored in
+# the database. Names are module path plus class name, see
+# pymerlin_adapter.get_fullname_from_process_class. Bare class names are
+# looked up in pymerlin.processes for models stored by older versions.
+
+DEFAULT_MODULE = 'pymerlin.processes'
+
+
+def resolve_process_class(name: str) -> type:
+    """
+    Imports the process class called name.
+    :raises ValueError: if there is no such merlin.Process subclass
+    """
+    mod_path = name.split('.')[:-1]
+    module_name = '.'.join(mod_path) if mod_path else DEFAULT_MODULE
+    try:
+        namespace = importlib.import_module(module_name).__dict__
+    except ImportError:
+        raise ValueError(
+            'module containing process class %s could not be imported'
+            % name)
+    the_class = namespace.get(name.split('.')[-1])
+    if not (inspect.isclass(the_class) and
+            issubclass(the_class, merlin.Process)):
+        raise ValueError('process class %s not found' % name)
+    return the_class
+
+
+class ProcessRegistry:
+    """
+    Cache of process classes by name. Each name is resolved, or found to be
+    unknown, only once per process.
+    """
+
+    def __init__(self):
+        self._classes = dict()
+        self._errors = dict()
+        self._lock = threading.Lock()
+
+    def register(self, the_class: type, name: str=None):
+        if name is None:
+            name = '{0}.{1}'.format(the_class.__module__, the_class.__name__)
+        with self._lock:
+            self._classes[name] = the_class
+            self._errors.pop(name, None)
+
+    def load_modules(self, modules: Iterable[str]):
+        """
+        Imports modules and registers every merlin.Process subclass in
+        their namespace.
+        """
+        for module_name in modules:
+            module = importlib.import_module(module_name)
+            for value in vars(module).values():
+                if (inspect.isclass(value) and
+                        issubclass(value, merlin.Process) and
+                        value is not merlin.Process):
+                    self.register(value)
+
+    def get(self, name: str) -> type:
+        """
+        :return: the process class called name
+        :raises ValueError: if there is no such process class
+        """
+        the_class = self._classes.get(name)
+        if the_class is not None:
+            return the_class
+        if name in self._errors:
+            raise ValueError(self._errors[name])
+        try:
+            the_class = resolve_process_class(name)
+        except ValueError as e:
+            with self._lock:
+                self._errors[name] = str(e)
+            raise
+        self.register(the_class, name)
+        return the_class
+
+    def preload(self, names: Iterable[str]) -> Mapping[str, str]:
+        """
+        Resolves every name up front.
+        :return: the error message of each name that could not be resolved
+        """
+        errors = dict()
+        for name in set(names):
+            try:
+                self.get(name)
+            except ValueError as e:
+                errors[name] = str(e)
+                logger.error('unknown process class {0}: {1}'.format(name, e))
+        return errors
+
+    def classes(self) -> Mapping[str, type]:
+        with self._lock:
+            return dict(self._classes)
+
+    def clear(self):
+        with self._lock:
+            self._classes.clear()
+            self._errors.clear()
+
+
+def describe_process_class(name: str, the_class: type) -> Mapping[str, Any]:
+    """
+    Lists the constructor parameters of a process class, and the properties,
+    inputs and outputs it declares. Those are only known once the class is
+    instantiated, which is attempted with the default parameter values.
+    """
+    parameters = list()
+    kwargs = dict()
+    instantiable = True
+    for param in list(inspect.signature(
+            the_class.__init__).parameters.values())[1:]:
+        if param.kind in (param.VAR_POSITIONAL, param.VAR_KEYWORD):
+            continue
+        required = param.default is param.empty
+        default = None if required else param.default
+        if not isinstance(default, (str, int, float, bool, type(None))):
+            default = repr(default)
+        parameters.append({
+            'name': param.name,
+            'required': required,
+            'default': default})
+        if required:
+            if param.name == 'name':
+                kwargs['name'] = the_class.__name__
+            else:
+                instantiable = False
+
+    description = {
+        'name': name,
+        'doc': inspect.getdoc(the_class),
+        'parameters': parameters,
+        'properties': None,
+        'inputs': None,
+        'outputs': None,
+    }
+    if not instantiable:
+        return description
+    try:
+        process = the_class(**kwargs)
+    except Exception:
+        logger.exception('could not instantiate process class ' + name)
+        return description
+    description['properties'] = [
+        {
+            'name': prop.name,
+            'property_type': prop.type.value,
+            'default_value': prop.default,
+            'min_value': prop.min_val,
+            'max_value': prop.max_val,
+            'readonly': prop.readonly,
+        } for prop in process.get_properties()]
+    description['inputs'] = [
+        {'name': i.name, 'unit_type': i.type}
+        for i in process.inputs.values()]
+    description['outputs'] = [
+        {'name': o.name, 'unit_type': o.type}
+        for o in process.outputs.values()]
+    return description
+
+
+process_registry = ProcessRegistry()
+
+
+def load_process_modules():
+    process_registry.load_modules(
+        getattr(settings, 'MERLIN_PROCESS_MODULES', [DEFAULT_MODULE]))
@@ -1,14 +1,61 @@
-import importlib
+import copy
+import itertools
 import logging
-from typing import MutableSequence, Mapping, Any, List
+import time
+from typing import MutableSequence, Mapping, Any, List, Optional, Tuple
 from pymerlin.processes import *
-from merlin_api import models
-from merlin_api.models import Simulation
+from merlin_api import checkpoints, models, parallel, result_cache
+from merlin_api.graphcopy import copy_graph
+from merlin_api.process_registry import process_registry
+from merlin_api.sim_cache import (
+    checkpoint_cache, scenario_cache, simulation_cache)
+from merlin_api.telemetry import compress_telemetry
 
 logger = logging.getLogger('merlin_api.pymerlin_adapter')
 
 # An interface between the Django db model and the pymerlin module
 
+# Relations that django2pymerlin walks when hydrating a simulation
+SIMULATION_GRAPH_PREFETCH = (
+    "outputs",
+    "outputs__unit_type",
+    "entities",
+    "entities__outputs",
+    "entities__outputs__unit_type",
+    "entities__outputs__endpoints",
+    "entities__outputs__endpoints__input",
+    "entities__outputs__endpoints__sim_output",
+    "entities__processes",
+    "entities__processes__properties",
+)
+
+
+def get_simulation_spec(sim: models.Simulation) -> Mapping[str, Any]:
+    """
+    Returns the django2spec output for the django sim. Specs are kept in a
+    per-worker cache keyed by the sim id and revision, so the database is
+    only read when the simulation has changed. The spec is shared and must
+    not be mutated.
+    :param sim: The django simulation, only its id and revision are used
+    """
+    spec = simulation_cache.get(sim.id, sim.revision)
+    if spec is None:
+        graph = models.Simulation.objects.prefetch_related(
+            *SIMULATION_GRAPH_PREFETCH).get(pk=sim.id)
+        spec = django2spec(graph)
+        simulation_cache.put(sim.id, sim.revision, spec)
+    return spec
+
+
+def get_pymerlin_simulation(sim: models.Simulation) -> merlin.Simulation:
+    """
+    Returns a merlin.Simulation for the django sim. Every call builds a new
+    graph from the cached spec, see get_simulation_spec.
+    :param sim: The django simulation, only its id and revision are used
+    :return: A private hydrated simulation
+    """
+    return spec2pymerlin(get_simulation_spec(sim))
+
 
 def run_simulation(
         sim: models.Simulation,
@@ -16,35 +63,114 @@ def run_simulation(
         steps: int=-1) -> \
         MutableSequence[Mapping[str, Any]]:
     """
-    Runs the supplied simulation and returns the resulting telemetry data
+    Runs the supplied simulation and returns the resulting telemetry data.
+    Results are cached by the revisions of the sim and scenarios, so an
+    identical run is served from the cache.
     :param sim:
     :param scenarios: A set of scenarios to run on the sim
     :param steps: How many steps to run the sim over, default -1 means
      just use the default setting for the sim
     :return:
     """
+    return run_simulation_timed(sim, scenarios, steps)[0]
 
-    msim = django2pymerlin(sim)
-    m_scenarios = list()
 
-    if scenarios:
-        for ds in scenarios:
-            try:
-                ms = django_scenario2pymerlin(ds, msim)
-            except ValueError as e:
-                error_dict = dict()
-                error_dict['scenario'] = dict()
-                error_dict['scenario']['id'] = ds.id
-                error_dict['scenario']['message'] = list()
-                error_dict['scenario']['message'].append(str(e))
-                return error_dict
-            m_scenarios.append(ms)
-
-    # msim = tests.create_test_simulation()
-    msim.run(scenarios=m_scenarios, end=steps)
+def run_simulation_timed(
+        sim: models.Simulation,
+        scenarios: List[models.Scenario]=list(),
+        steps: int=-1) -> \
+        Tuple[MutableSequence[Mapping[str, Any]], Optional[float]]:
+    """
+    Like run_simulation, but also returns how long the run took.
+    :return: the telemetry, and the seconds it took to simulate or None
+     if it was served from the result cache
+    """
+
+    key = result_cache.telemetry_key(sim, scenarios, steps)
+    telemetry = result_cache.get_telemetry(key)
+    if telemetry is not None:
+        return telemetry, None
+
+    start = time.perf_counter()
+    telemetry = run_checkpointed(
+        sim, [django_scenario2spec(ds) for ds in scenarios], steps)
+    duration = time.perf_counter() - start
+    if not isinstance(telemetry, dict):
+        result_cache.set_telemetry(key, telemetry)
+    return telemetry, duration
+
+
+def run_checkpointed(
+        sim: models.Simulation,
+        specs: List[Mapping[str, Any]],
+        steps: int=-1) -> MutableSequence[Mapping[str, Any]]:
+    """
+    Runs the simulation with the scenario specs, resuming from the latest
+    checkpoint of an earlier run that fired the same events up to it, and
+    taking new checkpoints every MERLIN_CHECKPOINT_INTERVAL steps.
+    :param sim:
+    :param specs: The output of django_scenario2spec for each scenario
+    :param steps: How many steps to run the sim over, default -1 means
+     just use the default setting for the sim
+    :return: the telemetry, or a scenario error dict
+    """
+    end = steps if steps > 0 else sim.num_steps
+    marks = checkpoints.checkpoint_steps(end, checkpoints.get_interval())
+
+    start = 0
+    msim = None
+    for t in reversed(marks):
+        msim = checkpoint_cache.get(
+            checkpoints.checkpoint_key(sim, specs, t), sim.revision)
+        if msim is not None:
+            start = t
+            break
+    if msim is None:
+        msim = get_pymerlin_simulation(sim)
+
+    m_scenarios = list()
+    for spec in specs:
+        try:
+            m_scenarios.append(scenario_spec2pymerlin(spec, msim))
+        except ValueError as e:
+            return scenario_error(spec['id'], e)
+
+    if not marks:
+        msim.run(scenarios=m_scenarios, end=steps)
+        return msim.get_sim_telemetry()
+
+    for t in [m for m in marks if m > start] + [end]:
+        msim.run(scenarios=m_scenarios, start=start + 1, end=t)
+        if t != end:
+            checkpoint_cache.put(
+                checkpoints.checkpoint_key(sim, specs, t),
+                sim.revision,
+                copy_graph(msim))
+        start = t
     return msim.get_sim_telemetry()
 
 
+def save_simulation_run(
+        sim: models.Simulation,
+        scenarios: List[models.Scenario],
+        steps: int,
+        telemetry: MutableSequence[Mapping[str, Any]],
+        duration: float=None) -> models.SimulationRun:
+    """
+    Stores the telemetry of a run in the database
+    :param duration: Seconds it took to produce the telemetry, None if it
+     came from the result cache
+    :return: the new run
+    """
+    return models.SimulationRun.objects.create(
+        sim=sim,
+        revision=sim.revision,
+        scenarios=[s.id for s in scenarios],
+        steps=steps,
+        duration=duration,
+        telemetry=compress_telemetry(telemetry))
+
+
 def pymerlin_scenario2django(
         scenario: merlin.Scenario,
         sim: models.Simulation) -> models.Scenario:
@@ -72,6 +198,66 @@ def pymerlin_scenario2django(
     return ds
 
 
+def django_scenario2spec(scenario: models.Scenario) -> Mapping[str, Any]:
+    """
+    Extracts the data needed to build a merlin.Scenario into plain python
+    objects, so it can be converted away from the database, e.g. in a
+    worker process.
+    :param scenario: The django scenario model instance
+    :return: a dict of the scenario fields and its events
+    """
+    return {
+        'id': scenario.id,
+        'revision': scenario.revision,
+        'name': scenario.name,
+        'start_offset': scenario.start_offset,
+        'events': [
+            {
+                'id': e.id,
+                'name': e.name,
+                'time': e.time,
+                'actions': e.actions
+            } for e in scenario.events.all()]
+    }
+
+
+def scenario_spec2pymerlin(
+        spec: Mapping[str, Any],
+        sim: merlin.Simulation) -> merlin.Scenario:
+    """
+    Builds a merlin.Scenario from the output of django_scenario2spec
+    :param spec: The scenario data
+    :param sim: the already deserialised simulation to relate the
+    scenario to.
+    :return: The merlin.Scenario representation
+    """
+
+    s = merlin.Scenario(set(), sim=sim)
+    s.id = spec['id']
+    s.name = spec['name']
+    s.start_offset = spec['start_offset']
+
+    # parsing the actions is the expensive part, the events are cached by
+    # scenario revision, which is bumped whenever one of them changes
+    revision = spec.get('revision')
+    events = None
+    if revision is not None:
+        events = scenario_cache.get(spec['id'], revision)
+    if events is None:
+        events = list()
+        for e in spec['events']:
+            p_event = merlin.Event.create_from_dict(e['time'], e['actions'])
+            p_event.id = e['id']
+            p_event.name = e['name']
+            events.append(p_event)
+        if revision is not None:
+            scenario_cache.put(spec['id'], revision, events)
+            events = copy.deepcopy(events)
+    s.events = set(events)
+
+    return s
+
+
 def django_scenario2pymerlin(
         scenario: models.Scenario,
         sim: merlin.Simulation) -> merlin.Scenario:
@@ -82,21 +268,193 @@ def django_scenario2pymerlin(
     scenario to.
     :return: The merlin.Scenario representation
     """
+    return scenario_spec2pymerlin(django_scenario2spec(scenario), sim)
 
-    s = merlin.Scenario(set(), sim=sim)
-    s.id = scenario.id
-    s.name = scenario.name
-    s.start_offset = scenario.start_offset
-    s.events = set()
-
-    for e in scenario.events.all():
-        # print(e.actions)
-        p_event = merlin.Event.create_from_dict(e.time, e.actions)
-        p_event.id = e.id
-        p_event.name = e.name
-        s.events.add(p_event)
 
-    return s
+def scenario_error(scenario_id: int, e: Exception) -> Mapping[str, Any]:
+    error_dict = dict()
+    error_dict['scenario'] = dict()
+    error_dict['scenario']['id'] = scenario_id
+    error_dict['scenario']['message'] = list()
+    error_dict['scenario']['message'].append(str(e))
+    return error_dict
+
+
+def run_scenario_specs(
+        sim_spec: Mapping[str, Any],
+        run: Any) -> MutableSequence[Mapping[str, Any]]:
+    """
+    Hydrates the simulation spec and runs it with scenarios built from
+    specs, this is the unit of work of a batch run and is executed in a
+    worker process.
+    :param sim_spec: The output of django2spec
+    :param run: A (scenario specs, steps) tuple
+    :return: the telemetry, or a scenario error dict
+    """
+    msim = spec2pymerlin(sim_spec)
+    specs, steps = run
+    m_scenarios = list()
+    for spec in specs:
+        try:
+            m_scenarios.append(scenario_spec2pymerlin(spec, msim))
+        except ValueError as e:
+            return scenario_error(spec['id'], e)
+    msim.run(scenarios=m_scenarios, end=steps)
+    return msim.get_sim_telemetry()
+
+
+def run_simulation_batch(
+        sim: models.Simulation,
+        variants: List[List[models.Scenario]],
+        steps: int=-1) -> List[MutableSequence[Mapping[str, Any]]]:
+    """
+    Runs the simulation once for each set of scenarios in variants. The
+    simulation is read once and the variants are run in parallel worker
+    processes, each hydrating its own graph from the simulation spec.
+    :param sim:
+    :param variants: A list of scenario lists, one per run
+    :param steps: How many steps to run the sim over
+    :return: the telemetry (or scenario error dict) of each variant, in
+     the order of variants
+    """
+    results = [None] * len(variants)
+    keys = list()
+    pending = list()
+    for i, scenarios in enumerate(variants):
+        key = result_cache.telemetry_key(sim, scenarios, steps)
+        keys.append(key)
+        results[i] = result_cache.get_telemetry(key)
+        if results[i] is None:
+            pending.append(i)
+
+    if pending:
+        runs = [
+            ([django_scenario2spec(ds) for ds in variants[i]], steps)
+            for i in pending]
+        ran = parallel.map_parallel(
+            run_scenario_specs, get_simulation_spec(sim), runs)
+        for i, telemetry in zip(pending, ran):
+            results[i] = telemetry
+            if not isinstance(telemetry, dict):
+                result_cache.set_telemetry(keys[i], telemetry)
+    return results
+
+
+def run_comparison(
+        sim: models.Simulation,
+        scenarios: List[models.Scenario],
+        steps: int=-1) -> Mapping[str, Any]:
+    """
+    Runs the simulation without scenarios, and with each scenario on its
+    own, as one batch of parallel runs. Scenarios none of whose events
+    fire within the run share the baseline telemetry instead of being run.
+    :param sim:
+    :param scenarios: The scenarios to compare with the baseline
+    :param steps: How many steps to run the sim over
+    :return: the baseline telemetry and the telemetry of each scenario
+    """
+    end = steps if steps > 0 else sim.num_steps
+    fired = [
+        any(checkpoints.event_step(spec, e) <= end for e in spec['events'])
+        for spec in [django_scenario2spec(ds) for ds in scenarios]]
+
+    ran = run_simulation_batch(
+        sim,
+        [[]] + [[ds] for ds, f in zip(scenarios, fired) if f],
+        steps)
+    baseline = ran[0]
+    results = iter(ran[1:])
+
+    return {
+        'baseline': baseline,
+        'scenarios': [
+            {'id': ds.id, 'telemetry': next(results) if f else baseline}
+            for ds, f in zip(scenarios, fired)]
+    }
+
+
+def expand_property_grid(
+        grid: Mapping[int, List[float]]) -> List[Mapping[int, float]]:
+    """
+    Expands a grid of process property values into the list of every
+    combination of them.
+    :param grid: candidate values keyed by process property id
+    :return: one {property id: value} override dict per combination
+    """
+    pp_ids = sorted(grid.keys())
+    return [
+        dict(zip(pp_ids, values))
+        for values in itertools.product(*[grid[pp_id] for pp_id in pp_ids])]
+
+
+def run_property_overrides(
+        sim_spec: Mapping[str, Any], run: Any) -> List[List[float]]:
+    """
+    Hydrates the simulation spec, applies process property overrides and
+    runs it, this is the unit of work of a sweep and is executed in a
+    worker process.
+    :param sim_spec: The output of django2spec
+    :param run: A (overrides, scenario specs, steps) tuple
+    :return: the result series of every sim output, ordered by output id,
+     or a scenario error dict
+    """
+    msim = spec2pymerlin(sim_spec)
+    properties = {
+        pp.id: pp
+        for e in msim.get_entities()
+        for p in e.get_processes()
+        for pp in p.get_properties()}
+    overrides, specs, steps = run
+    for pp_id, value in overrides.items():
+        properties[pp_id].set_value(value)
+    m_scenarios = list()
+    for spec in specs:
+        try:
+            m_scenarios.append(scenario_spec2pymerlin(spec, msim))
+        except ValueError as e:
+            return scenario_error(spec['id'], e)
+    msim.run(scenarios=m_scenarios, end=steps)
+    return [
+        list(o.result) for o in sorted(msim.outputs, key=lambda o: o.id)]
+
+
+def sweep_simulation(
+        sim: models.Simulation,
+        overrides: List[Mapping[int, float]],
+        scenarios: List[models.Scenario]=list(),
+        steps: int=-1) -> Mapping[str, Any]:
+    """
+    Runs the simulation once per entry in overrides, each applying its
+    process property values on top of the same simulation. Runs are
+    executed in parallel worker processes.
+    :param sim:
+    :param overrides: {process property id: value} dicts, one per variant
+    :param scenarios: Scenarios applied to every variant
+    :param steps: How many steps to run the sim over
+    :return: a result cube with data indexed by variant, output and step
+    """
+    sim_spec = get_simulation_spec(sim)
+    properties = {
+        pp['id'] for p in sim_spec['processes'] for pp in p['properties']}
+    unknown = {pp_id for o in overrides for pp_id in o} - properties
+    if unknown:
+        raise ValueError(
+            'unknown process properties {0}'.format(sorted(unknown)))
+
+    specs = [django_scenario2spec(ds) for ds in scenarios]
+    results = parallel.map_parallel(
+        run_property_overrides,
+        sim_spec,
+        [(o, specs, steps) for o in overrides])
+
+    return {
+        'outputs': [
+            {'id': o['id'], 'name': o['name'], 'type': o['unit_type']}
+            for o in sorted(sim_spec['outputs'], key=lambda o: o['id'])],
+        'variants': overrides,
+        'errors': [r if isinstance(r, dict) else None for r in results],
+        'data': [None if isinstance(r, dict) else r for r in results]
+    }
 
 
 def delete_django_sim(sim_id: int) -> None:
@@ -104,10 +462,9 @@ def delete_django_sim(sim_id: int) -> None:
     Deletes the django simulation model from the
     database without violating integrity constraints.
     """
-    sim = Simulation.objects.get(pk=sim_id)
-    sim.entities.all().delete()
-    sim.outputs.all().delete()
-    sim.delete()
+    # imported here, bulk itself depends on this module
+    from .bulk import delete_simulation
+    delete_simulation(sim_id)
 
 
 def get_fullname_from_process_class(the_class: type) -> str:
@@ -137,179 +494,234 @@ def get_process_class_from_fullname(the_name: str) -> type:
     :param str the_name: name used to import the module and find the
        merlin.Process subclass
     :returns: the class (not the object!)
-    
-    This is the inverse of the :py:func:`.get_process_class_from_fullname`.
+
+    This is the inverse of the :py:func:`.get_fullname_from_process_class`.
+    Classes are resolved once and cached, see
+    :py:mod:`merlin_api.process_registry`.
     """
-    # split name into parts
-    mod_path = the_name.split(".")[:-1]
-    if len(mod_path):
-        try:
-            namespace = importlib.import_module(".".join(mod_path)).__dict__
-        except ImportError:
-            raise ValueError(
-                'module containing process class %s could not be imported'
-                % the_name)
-    else:
-        # don't like this!
-        namespace = globals()
-    class_def = the_name.split(".")[-1]
-    if class_def not in namespace:
-            raise ValueError('process class %s not found' % the_name)
-
-    # execute this function
-    return namespace[class_def]
+    return process_registry.get(the_name)
 
 
-def django2pymerlin(sim: models.Simulation) -> merlin.Simulation:
+def django2spec(sim: models.Simulation) -> Mapping[str, Any]:
     """
-    Instantiates a merlin.Simulation from a django model sim
-    :type sim: models.Simulation
-    :param sim:
+    Extracts everything django2pymerlin needs from a simulation, loaded
+    with SIMULATION_GRAPH_PREFETCH, into flat plain python data. Unlike
+    the merlin graph, a spec has no reference cycles, so it is cheap to
+    keep in the simulation cache and hydrate from on every hit.
+    :param sim: The django simulation with its graph prefetched
+    :return: a dict of the simulation fields and its rows
+    """
+    entities = list(sim.entities.all())
+    return {
+        'id': sim.id,
+        'name': sim.name,
+        'num_steps': sim.num_steps,
+        'outputs': [
+            {
+                'id': o.id,
+                'name': o.name,
+                'unit_type': o.unit_type.value,
+                'minimum': o.minimum,
+            } for o in sim.outputs.all()],
+        'entities': [
+            {
+                'id': e.id,
+                'name': e.name,
+                'attributes': list(e.attributes),
+                'is_source': e.is_source,
+                'parent_id': e.parent_id,
+            } for e in entities],
+        'connectors': [
+            {
+                'id': o.id,
+                'entity_id': e.id,
+                'unit_type': o.unit_type.value,
+                'apportion_rule': o.apportion_rule,
+                'endpoints': [
+                    {
+                        'id': ep.id,
+                        'name': ep.name,
+                        'bias': ep.bias,
+                        'input_id': ep.input_id,
+                        'sim_output_id': ep.sim_output_id,
+                        # the entity or sim output fed by the endpoint
+                        'target_id': (
+                            ep.sim_output.parent_id if ep.input_id is None
+                            else ep.input.parent_id),
+                        'additive_write': (
+                            ep.sim_output.additive_write
+                            if ep.input_id is None
+                            else ep.input.additive_write),
+                    } for ep in o.endpoints.all()],
+            } for e in entities for o in e.outputs.all()],
+        'processes': [
+            {
+                'id': p.id,
+                'entity_id': e.id,
+                'process_class': p.process_class,
+                'parameters': p.parameters,
+                'priority': p.priority,
+                'properties': [
+                    {
+                        'id': pp.id,
+                        'name': pp.name,
+                        'max_value': pp.max_value,
+                        'min_value': pp.min_value,
+                        'readonly': pp.readonly,
+                        'property_value': pp.property_value,
+                    } for pp in p.properties.all()],
+            } for e in entities for p in e.processes.all()],
+    }
+
+
+def spec2pymerlin(spec: Mapping[str, Any]) -> merlin.Simulation:
+    """
+    Instantiates a merlin.Simulation from the output of django2spec. Every
+    row is visited a fixed number of times and merlin objects are looked
+    up through index maps, so hydration is linear in the size of the
+    model. The spec is only read, it can be hydrated from again.
+    :param spec: The simulation data
     :return merlin.Simulation:
     """
 
     # Simulation
     msim = merlin.Simulation()
-    msim.set_time_span(sim.num_steps)
-    msim.name = sim.name
+    msim.set_time_span(spec['num_steps'])
+    msim.name = spec['name']
 
     # Outputs
     moutputs = dict()
-    for o in sim.outputs.all():
-        moutput = merlin.Output(o.unit_type.value, name=o.name)
-        moutput.id = o.id
-        moutput.minimum = o.minimum
-        moutputs[o.id] = moutput
+    for o in spec['outputs']:
+        moutput = merlin.Output(o['unit_type'], name=o['name'])
+        moutput.id = o['id']
+        moutput.minimum = o['minimum']
+        moutputs[o['id']] = moutput
         msim.add_output(moutput)
 
     # Entities
     smentities = list()
     mentities = dict()
 
-    for e in sim.entities.all():
+    for e in spec['entities']:
         mentity = merlin.Entity(
             msim,
-            name=e.name,
-            attributes=set(e.attributes))
-        if e.is_source:
+            name=e['name'],
+            attributes=set(e['attributes']))
+        if e['is_source']:
             smentities.append(mentity)
-        mentity.id = e.id
-        mentities[e.id] = mentity
+        mentity.id = e['id']
+        mentities[e['id']] = mentity
 
     msim.add_entities(mentities.values())
     msim.set_source_entities(smentities)
 
     # add parent relationships
-    for e in sim.entities.all():
-        if e.parent:
-            child = mentities[e.id]
-            parent = mentities[e.parent.id]
+    for e in spec['entities']:
+        if e['parent_id'] is not None:
+            child = mentities[e['id']]
+            parent = mentities[e['parent_id']]
             msim.parent_entity(parent, child)
 
+    def endpoint_target(ep):
+        # the merlin entity or sim output that an endpoint feeds
+        if ep['input_id'] is None:
+            return moutputs[ep['target_id']]
+        return mentities[ep['target_id']]
+
+    connectors = {e['id']: list() for e in spec['entities']}
+    for o in spec['connectors']:
+        connectors[o['entity_id']].append(o)
+    processes = {e['id']: list() for e in spec['entities']}
+    for p in spec['processes']:
+        processes[p['entity_id']].append(p)
+
     # Sim Connections
-    for e in sim.entities.all():
-        for o in e.outputs.all():
-            for ep in o.endpoints.all():
-                if ep.input is None:
+    for e in spec['entities']:
+        mentity = mentities[e['id']]
+        for o in connectors[e['id']]:
+            rule = merlin.OutputConnector.ApportioningRules(
+                o['apportion_rule'])
+            for ep in o['endpoints']:
+                if ep['input_id'] is None:
                     # Connect to an output
                     msim.connect_output(
-                        mentities[e.id],
-                        moutputs[ep.sim_output.parent.id],
-                        ep.sim_output.additive_write,
-                        merlin.OutputConnector.ApportioningRules(
-                            o.apportion_rule))
-
-                    # add endpoint details
-                    op = mentities[e.id].get_output_by_type(o.unit_type.value)
-
-                    # now find the new endpoint connection that has been made
-                    for new_endpoint in op.get_endpoint_objects():
-                        if new_endpoint.connector.parent == moutputs[ep.sim_output.parent.id]:
-                            new_endpoint.id = ep.id
-                            new_endpoint.bias = ep.bias
-                            new_endpoint.name = ep.name
-
+                        mentity,
+                        endpoint_target(ep),
+                        ep['additive_write'],
+                        rule)
                 else:
                     # Connect to another entity
                     msim.connect_entities(
-                        mentities[e.id],
-                        mentities[ep.input.parent.id],
-                        o.unit_type.value,
-                        ep.input.additive_write,
-                        merlin.OutputConnector.ApportioningRules(
-                            o.apportion_rule))
-
-                    # add endpoint details
-                    op = mentities[e.id].get_output_by_type(o.unit_type.value)
-
-                    # now find the new endpoint connection that has been made
-                    for new_endpoint in op.get_endpoint_objects():
-                        if new_endpoint.connector.parent == mentities[ep.input.parent.id]:
-                            new_endpoint.id = ep.id
-                            new_endpoint.bias = ep.bias
-                            new_endpoint.name = ep.name
-
-        for p in e.processes.all():
-            mproc_class = get_process_class_from_fullname(p.process_class)
-            mproc = mentities[e.id].create_process(
+                        mentity,
+                        endpoint_target(ep),
+                        o['unit_type'],
+                        ep['additive_write'],
+                        rule)
+
+        output_types = {mo.type for mo in mentity.outputs}
+        for p in processes[e['id']]:
+            mproc_class = process_registry.get(p['process_class'])
+            mproc = mentity.create_process(
                 mproc_class,
-                p.parameters,
-                p.priority)   # type: merlin.Process
-            mproc.id = p.id
+                copy.deepcopy(p['parameters']),
+                p['priority'])   # type: merlin.Process
+            mproc.id = p['id']
 
             for mproc_output in mproc.outputs.values():
-                match = False
-                for mi in mentities[e.id].outputs:
-                    if mi.type == mproc_output.type:
-                        match = True
-                        break
-
-                if not match:
+                if mproc_output.type not in output_types:
                     logging.error("""output missmatch: process= {0} output= {1}
                     has no matching output in entity= {2}""".format(
                         mproc,
                         mproc_output,
-                        mentities[e.id]))
+                        mentity))
 
             # load in the process property values
-            for pprop in p.properties.all():
-                mpprop = mproc.get_prop(pprop.name)
+            for pprop in p['properties']:
+                mpprop = mproc.get_prop(pprop['name'])
                 assert mpprop is not None
-                mpprop.id = pprop.id
-                mpprop.max_val = pprop.max_value
-                mpprop.min_val = pprop.min_value
-                mpprop.readonly = pprop.readonly
-                mpprop.set_value(pprop.property_value)
-
-    # rewrite input and output connector ids
-    # for dso in sim.outputs.all():
-    #     for di in dso.inputs.all():
-    #         for i in moutputs[dso.id].inputs:
-    #             if i.source.parent.id == di.source.parent.id:
-    #                 i.id = di.id
-
-    for e in sim.entities.all():
-        for o in e.outputs.all():
-            # iterate through outputs in matching merlin entity
-            for mout_con in mentities[e.id].outputs:
-                if mout_con.type == o.unit_type.value:
-                    # we have found the matching output connector (mout_con <-> o)
-                    # remap id to django id
-                    mout_con.id = o.id
-                    # we now need to remap the input ids
-                    for ep in o.endpoints.all():
-                        # We need to try and find the matching merlin endpoint
-                        for mep in mout_con.get_endpoint_objects():
-                            # matching on endpoint id
-                            if mep.id == ep.id:
-                                if ep.input:
-                                    mep.connector.id = ep.input.id
-                                else:
-                                    mep.connector.id = ep.sim_output.id
+                mpprop.id = pprop['id']
+                mpprop.max_val = pprop['max_value']
+                mpprop.min_val = pprop['min_value']
+                mpprop.readonly = pprop['readonly']
+                mpprop.set_value(pprop['property_value'])
+
+    # Remap output connector, endpoint and input connector ids to the
+    # django ids. Each merlin output connector is indexed by type and each
+    # of its endpoints by target, an output only feeds a given entity or
+    # sim output once.
+    mout_cons = {
+        e_id: {mo.type: mo for mo in mentity.outputs}
+        for e_id, mentity in mentities.items()}
+    for o in spec['connectors']:
+        mout_con = mout_cons[o['entity_id']][o['unit_type']]
+        mout_con.id = o['id']
+        mendpoints = {
+            id(mep.connector.parent): mep
+            for mep in mout_con.get_endpoint_objects()}
+        for ep in o['endpoints']:
+            mep = mendpoints[id(endpoint_target(ep))]
+            mep.id = ep['id']
+            mep.bias = ep['bias']
+            mep.name = ep['name']
+            if ep['input_id'] is None:
+                mep.connector.id = ep['sim_output_id']
+            else:
+                mep.connector.id = ep['input_id']
 
     return msim
 
 
+def django2pymerlin(sim: models.Simulation) -> merlin.Simulation:
+    """
+    Instantiates a merlin.Simulation from a django model sim, see
+    spec2pymerlin.
+    :type sim: models.Simulation
+    :param sim:
+    :return merlin.Simulation:
+    """
+    return spec2pymerlin(django2spec(sim))
+
+
 def pymerlin2django(sim: merlin.Simulation) -> int:
     """
     Inserts the simulation object into the django
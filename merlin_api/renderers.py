@@ -0,0 +1,87 @@
+import json
+from typing import Any, Iterator
+from rest_framework import renderers
+from rest_framework.utils import encoders
+from .telemetry import DTYPES, encode_telemetry
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Renderers for simulation telemetry and large read responses
+
+
+def iter_ndjson(data: Any) -> Iterator[bytes]:
+    """
+    Encodes data as newline delimited json, one line per item of a list
+    """
+    items = data if isinstance(data, list) else [data]
+    for item in items:
+        yield json.dumps(
+            item,
+            cls=encoders.JSONEncoder,
+            ensure_ascii=False,
+            separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+class NDJSONRenderer(renderers.BaseRenderer):
+    """
+    Renders a list as newline delimited json. Views that want a low time to
+    first byte should stream iter_ndjson directly, this renderer is used
+    for content negotiation and non streamed responses.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return b''.join(iter_ndjson(data))
+
+
+class TelemetryBinaryRenderer(renderers.BaseRenderer):
+    """
+    Renders telemetry in the columnar binary format of
+    merlin_api.telemetry, as float64 columns or float32 with dtype=float32.
+    Anything that is not telemetry, e.g. an error dict, is rendered as
+    json.
+    """
+    media_type = 'application/vnd.merlin.telemetry'
+    format = 'bin'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        renderer_context = renderer_context or {}
+        response = renderer_context.get('response')
+        if not isinstance(data, list) or (
+                response is not None and response.status_code >= 400):
+            if response is not None:
+                response['Content-Type'] = 'application/json'
+            return renderers.JSONRenderer().render(data)
+        request = renderer_context.get('request')
+        dtype = 'float64'
+        if request is not None:
+            dtype = request.query_params.get('dtype', dtype)
+            if dtype not in DTYPES:
+                dtype = 'float64'
+        return encode_telemetry(data, dtype)
+
+
+class ORJSONRenderer(renderers.JSONRenderer):
+    """
+    Renders json with orjson when it is installed, which is several times
+    faster than the standard library encoder on large trees. Falls back to
+    the default json renderer without orjson, or when indented output is
+    asked for.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        renderer_context = renderer_context or {}
+        if orjson is None or data is None or \
+                self.get_indent(accepted_media_type, renderer_context):
+            return super().render(
+                data, accepted_media_type, renderer_context)
+        return orjson.dumps(
+            data,
+            default=self.encoder_class().default,
+            option=orjson.OPT_NON_STR_KEYS)
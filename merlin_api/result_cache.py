@@ -0,0 +1,44 @@
+import hashlib
+import json
+from typing import Iterable, MutableSequence, Mapping, Any
+from django.conf import settings
+from django.core.cache import caches
+from . import models
+
+# Content addressed cache of simulation telemetry. A run is fully determined
+# by the simulation graph, the ordered scenarios and their events, and the
+# number of steps, so the revisions of those make up the cache key.
+
+KEY_PREFIX = 'merlin:telemetry:'
+
+
+def get_cache():
+    return caches[getattr(settings, 'MERLIN_RESULT_CACHE', 'default')]
+
+
+def telemetry_key(
+        sim: models.Simulation,
+        scenarios: Iterable[models.Scenario],
+        steps: int) -> str:
+    """
+    :return: the fingerprint of a run of sim with scenarios over steps
+    """
+    fingerprint = {
+        'sim': [sim.id, sim.revision],
+        'scenarios': [[s.id, s.revision] for s in scenarios],
+        'steps': steps
+    }
+    digest = hashlib.sha1(
+        json.dumps(fingerprint, sort_keys=True).encode('utf-8')).hexdigest()
+    return KEY_PREFIX + digest
+
+
+def get_telemetry(key: str) -> MutableSequence[Mapping[str, Any]]:
+    return get_cache().get(key)
+
+
+def set_telemetry(key: str, telemetry: MutableSequence[Mapping[str, Any]]):
+    get_cache().set(
+        key,
+        telemetry,
+        getattr(settings, 'MERLIN_RESULT_CACHE_TIMEOUT', 3600))
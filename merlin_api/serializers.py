@@ -1,10 +1,59 @@
+import functools
+from typing import List, Tuple
 from rest_framework import serializers
 from .models import *
+from .telemetry import decode_telemetry, decompress_telemetry
 
 import logging
 logger = logging.getLogger('django')
 
 
+def serializer_prefetch_lookups(
+        serializer: serializers.Serializer, prefix: str='') -> List[str]:
+    """
+    Like get_prefetch_lookups, for a serializer instance whose fields may
+    have been changed after it was built
+    """
+    lookups = list()
+    for field in serializer.fields.values():
+        lookups.extend(field_prefetch_lookups(field, prefix))
+    return lookups
+
+
+def field_prefetch_lookups(
+        field: serializers.Field, prefix: str='') -> List[str]:
+    """
+    :return: the prefetch_related lookups a single serializer field needs
+    """
+    if field.source == '*':
+        return []
+    path = prefix + field.source.replace('.', '__')
+    if isinstance(field, serializers.ListSerializer):
+        return [path] + serializer_prefetch_lookups(field.child, path + '__')
+    elif isinstance(field, serializers.BaseSerializer):
+        return [path] + serializer_prefetch_lookups(field, path + '__')
+    elif isinstance(field, serializers.ManyRelatedField):
+        return [path]
+    elif isinstance(field, serializers.RelatedField) and \
+            not field.use_pk_only_optimization():
+        return [path]
+    return []
+
+
+@functools.lru_cache(maxsize=None)
+def get_prefetch_lookups(serializer_class: type) -> Tuple[str, ...]:
+    """
+    Walks the fields of a serializer and lists the prefetch_related lookups
+    that let it render a queryset without a query per related object:
+    nested serializers, to-many relations and related fields that need the
+    related row rather than just its key.
+    :param serializer_class: The serializer to plan for
+    :return: lookups for QuerySet.prefetch_related, parents first. The
+     result is cached and shared, hence immutable
+    """
+    return tuple(serializer_prefetch_lookups(serializer_class()))
+
+
 class ProjectPhaseSerializer(serializers.ModelSerializer):
     id = serializers.IntegerField(required=False)
 
@@ -313,4 +362,154 @@ class SimulationSerializer(serializers.HyperlinkedModelSerializer):
             'scenarios')
 
 
+class SimulationSummarySerializer(serializers.ModelSerializer):
+    """
+    A simulation without its graph, for listings. The counts are set on
+    the instances by the view, see SimulationViewSet.set_counts.
+    """
+
+    num_entities = serializers.IntegerField(read_only=True)
+    num_outputs = serializers.IntegerField(read_only=True)
+    num_scenarios = serializers.IntegerField(read_only=True)
+    num_processes = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Simulation
+        fields = (
+            'id',
+            'name',
+            'description',
+            'num_steps',
+            'start_date',
+            'num_entities',
+            'num_outputs',
+            'num_scenarios',
+            'num_processes')
+
+
+class PositionSerializer(serializers.Serializer):
+
+    id = serializers.IntegerField()
+    x = serializers.FloatField(allow_null=True)
+    y = serializers.FloatField(allow_null=True)
+
+
+class LayoutSerializer(serializers.Serializer):
+
+    entities = PositionSerializer(many=True, required=False)
+    outputs = PositionSerializer(many=True, required=False)
+
+
+class CloneSerializer(serializers.Serializer):
+
+    name = serializers.CharField(max_length=128, required=False)
+    scenarios = serializers.BooleanField(required=False)
+
+
+class SimulationJobSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = SimulationJob
+        fields = (
+            'id',
+            'kind',
+            'sim',
+            'scenarios',
+            'steps',
+            'status',
+            'created',
+            'started',
+            'finished')
+        read_only_fields = (
+            'kind', 'status', 'created', 'started', 'finished')
+        extra_kwargs = {'sim': {'required': True, 'allow_null': False}}
+
+    def validate(self, data):
+        scenarios = data.get('scenarios', [])
+        found = Scenario.objects.filter(
+            pk__in=scenarios, sim=data['sim']).count()
+        if found != len(set(scenarios)):
+            raise serializers.ValidationError(
+                {'scenarios': 'unknown scenario for this simulation'})
+        return data
+
+
+class SimulationJobResultSerializer(SimulationJobSerializer):
+
+    result = serializers.SerializerMethodField()
+
+    class Meta(SimulationJobSerializer.Meta):
+        fields = SimulationJobSerializer.Meta.fields + ('run', 'result')
+
+    def get_result(self, obj):
+        if obj.run is not None:
+            return decode_telemetry(decompress_telemetry(obj.run.telemetry))
+        return obj.result
+
+
+class RunSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = SimulationRun
+        fields = (
+            'id',
+            'sim',
+            'revision',
+            'scenarios',
+            'steps',
+            'duration',
+            'created')
+
+
+class RunResultSerializer(RunSerializer):
+
+    telemetry = serializers.SerializerMethodField()
+
+    class Meta(RunSerializer.Meta):
+        fields = RunSerializer.Meta.fields + ('telemetry',)
+
+    def get_telemetry(self, obj):
+        return decode_telemetry(decompress_telemetry(obj.telemetry))
+
+
+class SimulationBatchSerializer(serializers.Serializer):
+    variants = serializers.ListField(
+        child=serializers.ListField(child=serializers.IntegerField()))
+    steps = serializers.IntegerField(default=-1)
+
+    def validate_variants(self, value):
+        if not value:
+            raise serializers.ValidationError('no variants given')
+        return value
+
+
+class SimulationSweepSerializer(serializers.Serializer):
+    grid = serializers.DictField(
+        child=serializers.ListField(child=serializers.FloatField()),
+        required=False)
+    variants = serializers.ListField(
+        child=serializers.DictField(child=serializers.FloatField()),
+        required=False)
+    scenarios = serializers.ListField(
+        child=serializers.IntegerField(), required=False)
+    steps = serializers.IntegerField(default=-1)
+
+    @staticmethod
+    def _property_ids(d):
+        try:
+            return {int(k): v for k, v in d.items()}
+        except ValueError:
+            raise serializers.ValidationError(
+                'keys must be process property ids')
+
+    def validate_grid(self, value):
+        return self._property_ids(value)
+
+    def validate_variants(self, value):
+        return [self._property_ids(v) for v in value]
 
+    def validate(self, data):
+        if ('grid' in data) == ('variants' in data):
+            raise serializers.ValidationError(
+                'supply exactly one of grid or variants')
+        return data
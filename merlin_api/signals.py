@@ -0,0 +1,197 @@
+import functools
+from django.db.models.signals import (
+    post_delete, post_init, post_save, pre_save)
+from . import models
+from .sim_cache import checkpoint_cache, simulation_cache
+
+# Keeps Simulation.revision in step with the rows that make up a
+# simulation graph, and Scenario.revision in step with its events. Saves
+# that only move entities or outputs bump Simulation.layout_revision
+# instead, so the hydrated graph and its results stay cached.
+
+# For each graph model, the foreign key that leads towards the owning
+# simulation and the lookup on the related model that yields the sim id.
+# A lookup of None means the foreign key is the simulation itself.
+SIM_PATHS = {
+    models.UnitType: ('sim', None),
+    models.Attribute: ('sim', None),
+    models.Output: ('sim', None),
+    models.Entity: ('sim', None),
+    models.OutputConnector: ('parent', 'sim_id'),
+    models.InputConnector: ('parent', 'sim_id'),
+    models.SimOutputConnector: ('parent', 'sim_id'),
+    models.Endpoint: ('parent', 'parent__sim_id'),
+    models.Process: ('parent', 'sim_id'),
+    models.ProcessProperty: ('process', 'parent__sim_id'),
+}
+
+
+# Models with display positions and the fields that hold them
+LAYOUT_MODELS = (models.Entity, models.Output)
+LAYOUT_FIELDS = ('display_pos_x', 'display_pos_y')
+
+
+def get_sim_id(instance) -> int:
+    """
+    Resolves the id of the simulation that owns instance. This only relies
+    on the foreign key of the instance itself, so it also works from a
+    post_delete handler. A related object that is already loaded is used
+    instead of a query, and the result is kept on instance for its next
+    save.
+    """
+    field_name, lookup = SIM_PATHS[type(instance)]
+    field = instance._meta.get_field(field_name)
+    fk_value = getattr(instance, field.attname)
+    if lookup is None or fk_value is None:
+        return fk_value
+    resolved = getattr(instance, '_sim_id', None)
+    if resolved is not None and resolved[0] == fk_value:
+        return resolved[1]
+    related = getattr(instance, field.get_cache_name(), None)
+    if related is not None and type(related) in SIM_PATHS:
+        sim_id = get_sim_id(related)
+    else:
+        sim_id = field.related_model.objects.filter(
+            pk=fk_value).values_list(lookup, flat=True).first()
+    instance._sim_id = (fk_value, sim_id)
+    return sim_id
+
+
+def simulation_changed(sim_id: int) -> None:
+    if sim_id is None:
+        return
+    models.Simulation.bump_revision(sim_id)
+    simulation_cache.invalidate(sim_id)
+    checkpoint_cache.invalidate(sim_id)
+
+
+def layout_changed(sim_id: int) -> None:
+    if sim_id is None:
+        return
+    models.Simulation.bump_revision(sim_id, 'layout_revision')
+
+
+@functools.lru_cache(maxsize=None)
+def graph_columns(model) -> tuple:
+    """
+    :return: the columns of a layout model other than its display position
+    """
+    return tuple(
+        f.attname for f in model._meta.concrete_fields
+        if not f.primary_key and f.name not in LAYOUT_FIELDS)
+
+
+def remember_loaded(sender, instance, **kwargs):
+    # the values as loaded or last saved, read from __dict__ so deferred
+    # fields are not fetched
+    instance._graph_values = {
+        c: instance.__dict__[c] for c in graph_columns(type(instance))
+        if c in instance.__dict__}
+
+
+def is_layout_only(instance, update_fields=None) -> bool:
+    """
+    :return: whether saving instance only changes its display position
+    """
+    if instance._state.adding:
+        return False
+    if update_fields is not None:
+        return set(update_fields) <= set(LAYOUT_FIELDS)
+    loaded = getattr(instance, '_graph_values', None)
+    if loaded is None:
+        return False
+    current = {
+        c: instance.__dict__[c] for c in graph_columns(type(instance))
+        if c in instance.__dict__}
+    return current == loaded
+
+
+def layout_pre_save(sender, instance, raw=False, update_fields=None,
+                    **kwargs):
+    instance._layout_only = not raw and is_layout_only(
+        instance, update_fields)
+
+
+def graph_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if isinstance(instance, LAYOUT_MODELS):
+        remember_loaded(sender, instance)
+    if getattr(instance, '_layout_only', False):
+        layout_changed(get_sim_id(instance))
+        return
+    simulation_changed(get_sim_id(instance))
+
+
+def graph_deleted(sender, instance, **kwargs):
+    simulation_changed(get_sim_id(instance))
+
+
+def simulation_saved(sender, instance, created=False, raw=False, **kwargs):
+    # num_steps and name are part of the hydrated graph as well
+    if raw or created:
+        return
+    simulation_changed(instance.id)
+
+
+def simulation_deleted(sender, instance, **kwargs):
+    simulation_cache.invalidate(instance.id)
+    checkpoint_cache.invalidate(instance.id)
+
+
+def scenario_saved(sender, instance, created=False, raw=False, **kwargs):
+    if raw or created:
+        return
+    models.Scenario.bump_revision(instance.id)
+
+
+def event_changed(sender, instance, raw=False, **kwargs):
+    if raw or instance.scenario_id is None:
+        return
+    models.Scenario.bump_revision(instance.scenario_id)
+
+
+for graph_model in SIM_PATHS:
+    post_save.connect(
+        graph_saved,
+        sender=graph_model,
+        dispatch_uid='merlin_api.graph_saved.{0}'.format(
+            graph_model.__name__))
+    post_delete.connect(
+        graph_deleted,
+        sender=graph_model,
+        dispatch_uid='merlin_api.graph_deleted.{0}'.format(
+            graph_model.__name__))
+
+for layout_model in LAYOUT_MODELS:
+    post_init.connect(
+        remember_loaded,
+        sender=layout_model,
+        dispatch_uid='merlin_api.remember_loaded.{0}'.format(
+            layout_model.__name__))
+    pre_save.connect(
+        layout_pre_save,
+        sender=layout_model,
+        dispatch_uid='merlin_api.layout_pre_save.{0}'.format(
+            layout_model.__name__))
+
+post_save.connect(
+    simulation_saved,
+    sender=models.Simulation,
+    dispatch_uid='merlin_api.simulation_saved')
+post_delete.connect(
+    simulation_deleted,
+    sender=models.Simulation,
+    dispatch_uid='merlin_api.simulation_deleted')
+post_save.connect(
+    scenario_saved,
+    sender=models.Scenario,
+    dispatch_uid='merlin_api.scenario_saved')
+post_save.connect(
+    event_changed,
+    sender=models.Event,
+    dispatch_uid='merlin_api.event_saved')
+post_delete.connect(
+    event_changed,
+    sender=models.Event,
+    dispatch_uid='merlin_api.event_deleted')
@@ -0,0 +1,105 @@
+import copy
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+from django.conf import settings
+from merlin_api.graphcopy import copy_graph
+
+logger = logging.getLogger('merlin_api.sim_cache')
+
+# Per-worker caches of hydrated simulations, run checkpoints and parsed
+# scenario events
+
+
+class RevisionCache:
+    """
+    LRU cache of objects keyed by the id of the row they were built from.
+    Each entry remembers the content revision of the row, so a lookup with
+    a newer revision is a miss and the stale object gets replaced.
+
+    Hits are passed through copy, a deep copy by default, so callers are
+    free to mutate what they get. With copy None cached values are handed
+    out as they are and must be treated as immutable.
+    """
+
+    def __init__(self, max_size: int,
+                 copy: Optional[Callable[[Any], Any]]=copy.deepcopy):
+        self.max_size = max_size
+        self.copy = copy
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, revision: int) -> Optional[Any]:
+        """
+        :return: the cached object, copied if the cache copies, or None if
+         there is no entry for this revision
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != revision:
+                return None
+            self._entries.move_to_end(key)
+            value = entry[1]
+        return value if self.copy is None else self.copy(value)
+
+    def put(self, key: Hashable, revision: int, value: Any):
+        """
+        Stores value for key, evicting the least recently used entries if
+        the cache is over its size limit. The caller must not mutate value
+        after handing it to the cache.
+        """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            current = self._entries.get(key)
+            if current is not None and current[0] > revision:
+                return
+            self._entries[key] = (revision, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                evicted, _ = self._entries.popitem(last=False)
+                logger.debug('evicted {0} {1}'.format(
+                    type(self).__name__, evicted))
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class CheckpointCache(RevisionCache):
+    """
+    Cache of simulation state snapshots taken part way through a run, keyed
+    by (sim id, events fingerprint, step) and the revision of the sim.
+    Snapshots are copied with copy_graph, as the object graph of large
+    models is too deep for copy.deepcopy.
+    """
+
+    def __init__(self, max_size: int):
+        super().__init__(max_size, copy=copy_graph)
+
+    def invalidate(self, sim_id: int):
+        """
+        Drops every snapshot of the simulation
+        """
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == sim_id]:
+                del self._entries[key]
+
+
+# specs of hydrated simulations, see pymerlin_adapter.django2spec, keyed by
+# simulation id and revision
+simulation_cache = RevisionCache(
+    getattr(settings, 'MERLIN_SIM_CACHE_SIZE', 8), copy=None)
+checkpoint_cache = CheckpointCache(
+    getattr(settings, 'MERLIN_CHECKPOINT_CACHE_SIZE', 32))
+# parsed merlin.Events keyed by scenario id and revision
+scenario_cache = RevisionCache(
+    getattr(settings, 'MERLIN_SCENARIO_CACHE_SIZE', 256))
@@ -0,0 +1,152 @@
+from typing import List, Mapping, Set, Union
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+from .serializers import field_prefetch_lookups, get_prefetch_lookups
+
+# Sparse fieldsets for the model viewsets.
+#
+#   ?fields=id,name,outputs.name   only these fields, dotted for nested ones
+#   ?expand=outputs,processes      nested objects to render in full
+#
+# Once either parameter is given, nested objects that are neither expanded
+# nor selected with a dotted field are rendered as primary keys. The
+# queryset is pruned to match: only() loads the columns that are still
+# rendered, at the top level and in the prefetches of nested objects.
+
+
+def parse_field_paths(value: str) -> Mapping[str, dict]:
+    """
+    Parses 'a,b.c,b.d' into the tree {'a': {}, 'b': {'c': {}, 'd': {}}}
+    """
+    tree = dict()
+    for path in value.split(','):
+        node = tree
+        for name in path.strip().split('.'):
+            if name:
+                node = node.setdefault(name, dict())
+    return tree
+
+
+def prune_fields(
+        serializer: serializers.Serializer,
+        fields: Mapping[str, dict],
+        expand: Mapping[str, dict]):
+    """
+    Removes the fields of serializer that are not in fields, and replaces
+    nested serializers that are not expanded by their primary keys.
+    :param fields: tree of the fields to keep, None to keep them all
+    :param expand: tree of the nested serializers to keep
+    """
+    for name in list(serializer.fields.keys()):
+        if fields is not None and name not in fields:
+            serializer.fields.pop(name)
+            continue
+        field = serializer.fields[name]
+        many = isinstance(field, serializers.ListSerializer)
+        if not many and not isinstance(field, serializers.BaseSerializer):
+            continue
+        nested_fields = fields.get(name) if fields is not None else None
+        if name in expand or nested_fields:
+            prune_fields(
+                field.child if many else field,
+                nested_fields or None,
+                expand.get(name, dict()))
+        else:
+            kwargs = {'many': many, 'read_only': True}
+            if field.source != name:
+                kwargs['source'] = field.source
+            serializer.fields[name] = serializers.PrimaryKeyRelatedField(
+                **kwargs)
+
+
+def model_columns(serializer: serializers.ModelSerializer) -> Set[str]:
+    """
+    :return: the model fields serializer reads from its own table
+    """
+    opts = serializer.Meta.model._meta
+    columns = set()
+    for field in serializer.fields.values():
+        if field.source == '*':
+            continue
+        try:
+            model_field = opts.get_field(field.source.split('.')[0])
+        except FieldDoesNotExist:
+            continue
+        if model_field.concrete and not model_field.many_to_many:
+            columns.add(model_field.name)
+    return columns
+
+
+def sparse_prefetches(
+        serializer: serializers.ModelSerializer,
+        prefix: str='') -> List[Union[str, Prefetch]]:
+    """
+    Like serializer_prefetch_lookups, but nested model serializers get a
+    Prefetch whose queryset only loads the columns they render, plus the
+    key that links their rows back to the parent.
+    """
+    opts = serializer.Meta.model._meta
+    lookups = list()
+    for field in serializer.fields.values():
+        nested = getattr(field, 'child', field)
+        try:
+            relation = opts.get_field(field.source)
+        except FieldDoesNotExist:
+            relation = None
+        if relation is None or \
+                not isinstance(nested, serializers.ModelSerializer):
+            lookups.extend(field_prefetch_lookups(field, prefix))
+            continue
+        columns = model_columns(nested)
+        if relation.one_to_many or \
+                (relation.one_to_one and not relation.concrete):
+            # reverse foreign key, the rows are matched to parents by it
+            columns.add(relation.field.name)
+        path = prefix + field.source
+        lookups.append(Prefetch(
+            path, queryset=nested.Meta.model.objects.only(*columns)))
+        lookups.extend(sparse_prefetches(nested, path + '__'))
+    return lookups
+
+
+class SparseFieldsMixin:
+    """
+    Adds ?fields= and ?expand= to the GET actions of a model viewset, and
+    prefetches whatever the (pruned) serializer renders.
+    """
+
+    def get_sparse_fields(self):
+        """
+        :return: the (fields, expand) trees, both None if the request does
+         not ask for a sparse fieldset
+        """
+        if self.request is None or self.request.method != 'GET':
+            return None, None
+        params = self.request.query_params
+        if 'fields' not in params and 'expand' not in params:
+            return None, None
+        fields = params.get('fields')
+        return (
+            parse_field_paths(fields) if fields else None,
+            parse_field_paths(params.get('expand', '')))
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        fields, expand = self.get_sparse_fields()
+        if expand is not None:
+            prune_fields(
+                getattr(serializer, 'child', serializer), fields, expand)
+        return serializer
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request is None or self.request.method != 'GET':
+            return queryset
+        if self.get_sparse_fields()[1] is None:
+            # the full serializer, whose plan is cached per class
+            return queryset.prefetch_related(
+                *get_prefetch_lookups(self.get_serializer_class()))
+        serializer = self.get_serializer()
+        return queryset.only(*model_columns(serializer)).prefetch_related(
+            *sparse_prefetches(serializer))
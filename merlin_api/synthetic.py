@@ -0,0 +1,108 @@
+import random
+from typing import List
+from pymerlin import merlin
+from pymerlin.processes import BudgetProcess
+
+# Generators of synthetic models for benchmarking
+
+
+def create_synthetic_simulation(
+        num_entities: int,
+        fan_out: int=2,
+        fan_in: int=0,
+        depth: int=0,
+        processes_per_entity: int=0,
+        num_outputs: int=1,
+        num_steps: int=10,
+        seed: int=0) -> merlin.Simulation:
+    """
+    Creates a layered simulation of num_entities entities. Entity i feeds
+    the fan_out entities after it, and with fan_in each entity is also fed
+    by that many randomly chosen earlier entities, so the graph is always
+    acyclic. The last num_outputs entities feed one sim output each.
+
+    :param depth: nest the entities into parent chains depth levels deep
+    :param processes_per_entity: budget processes created on each entity
+    :param seed: seed of the fan_in choices
+    """
+    rng = random.Random(seed)
+    sim = merlin.Simulation(
+        config=[],
+        outputs=set(),
+        name='synthetic_{0}'.format(num_entities))
+    sim.set_time_span(num_steps)
+    sim.add_attributes(['synthetic'])
+    sim.add_unit_types(['$'])
+
+    entities = [
+        merlin.Entity(name='entity {0}'.format(i), attributes={'synthetic'})
+        for i in range(num_entities)]
+    sim.add_entities(entities)
+    sim.set_source_entities(entities[:1])
+
+    if depth > 0:
+        # entity i is the child of entity i - stride, giving chains of
+        # depth + 1 entities
+        stride = -(-num_entities // (depth + 1))
+        for i in range(stride, num_entities):
+            sim.parent_entity(entities[i - stride], entities[i])
+
+    edges = set()
+    for i in range(num_entities):
+        for j in range(i + 1, min(i + 1 + fan_out, num_entities)):
+            edges.add((i, j))
+        if i > 0 and fan_in > 0:
+            for j in rng.sample(range(i), min(fan_in, i)):
+                edges.add((j, i))
+    for i, j in sorted(edges):
+        sim.connect_entities(entities[i], entities[j], '$')
+
+    for i, e in enumerate(entities[-num_outputs:]):
+        output = merlin.Output('$', name='output {0}'.format(i))
+        sim.add_output(output)
+        sim.connect_output(e, output)
+
+    for i, e in enumerate(entities):
+        for k in range(processes_per_entity):
+            e.create_process(
+                BudgetProcess,
+                {
+                    'name': 'budget {0}.{1}'.format(i, k),
+                    'start_amount': 1000
+                })
+    return sim
+
+
+def create_synthetic_scenarios(
+        sim: merlin.Simulation,
+        num_scenarios: int,
+        num_events: int,
+        seed: int=0) -> List[merlin.Scenario]:
+    """
+    Creates scenarios of num_events events each, every event sets a random
+    process property of a random entity at a random step. The ids in the
+    events are those of sim, so pass a simulation hydrated from the
+    database if the scenarios are to be stored.
+    """
+    rng = random.Random(seed)
+    targets = [
+        (e, prop)
+        for e in sim.get_entities()
+        for p in e.get_processes()
+        for prop in p.get_properties()
+        if not prop.readonly]
+    if not targets:
+        raise ValueError('the simulation has no writable process properties')
+
+    scenarios = list()
+    for s in range(num_scenarios):
+        events = set()
+        for _ in range(num_events):
+            e, prop = rng.choice(targets)
+            events.add(merlin.Event.create(
+                rng.randint(1, sim.num_steps),
+                "Entity {0} := Property {1}, {2}".format(
+                    e.id, prop.id, prop.get_value())))
+        scenarios.append(merlin.Scenario(
+            events, sim=sim, name='synthetic scenario {0}'.format(s)))
+    return scenarios
@@ -0,0 +1,129 @@
+import json
+import math
+import numbers
+import struct
+import sys
+import zlib
+from array import array
+from typing import Any, MutableSequence, Mapping
+
+# Columnar binary encoding of simulation telemetry.
+#
+# Layout (all integers little endian):
+#   4 bytes   magic b'MTLM'
+#   uint32    length of the json header in bytes
+#   header    utf-8 json, padded with spaces to a multiple of 8 bytes
+#   columns   every numeric series as a packed array of header['dtype']
+#
+# The header is the telemetry itself with each numeric list replaced by
+# {"$column": n}, plus a "columns" table of [offset, length] pairs where
+# offset is relative to the start of the column section. A client holding
+# numpy can read column n without copying:
+#   numpy.frombuffer(body, dtype, count=length, offset=start + offset)
+# Missing values (None) are encoded as NaN.
+
+MAGIC = b'MTLM'
+VERSION = 1
+DTYPES = {
+    'float64': ('<f8', 'd'),
+    'float32': ('<f4', 'f'),
+}
+_ALIGN = 8
+
+
+def _is_series(value: Any) -> bool:
+    return (
+        isinstance(value, list) and
+        len(value) > 0 and
+        all(v is None or (isinstance(v, numbers.Real) and
+                          not isinstance(v, bool))
+            for v in value))
+
+
+def encode_telemetry(
+        telemetry: MutableSequence[Mapping[str, Any]],
+        dtype: str='float64') -> bytes:
+    """
+    Encodes telemetry into the columnar binary format
+    :param telemetry: The output of merlin.Simulation.get_sim_telemetry
+    :param dtype: float64 or float32
+    :return: the encoded bytes
+    """
+    np_type, array_type = DTYPES[dtype]
+    columns = list()
+    buffers = list()
+    offset = 0
+
+    def extract(value):
+        nonlocal offset
+        if _is_series(value):
+            a = array(
+                array_type,
+                [float('nan') if v is None else v for v in value])
+            if sys.byteorder == 'big':
+                a.byteswap()
+            columns.append([offset, len(value)])
+            buffers.append(a.tobytes())
+            offset += len(buffers[-1])
+            return {'$column': len(columns) - 1}
+        if isinstance(value, dict):
+            return {k: extract(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [extract(v) for v in value]
+        return value
+
+    objects = extract(telemetry)
+    header = json.dumps({
+        'version': VERSION,
+        'dtype': np_type,
+        'steps': max([c[1] for c in columns] or [0]),
+        'columns': columns,
+        'objects': objects,
+    }, separators=(',', ':')).encode('utf-8')
+    header += b' ' * (-(len(MAGIC) + 4 + len(header)) % _ALIGN)
+    return b''.join(
+        [MAGIC, struct.pack('<I', len(header)), header] + buffers)
+
+
+def decode_telemetry(data: bytes) -> MutableSequence[Mapping[str, Any]]:
+    """
+    The inverse of encode_telemetry, NaN values are returned as None
+    """
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError('not an encoded telemetry buffer')
+    header_len = struct.unpack_from('<I', data, len(MAGIC))[0]
+    start = len(MAGIC) + 4
+    header = json.loads(data[start:start + header_len].decode('utf-8'))
+    body = memoryview(data)[start + header_len:]
+    array_type = {v[0]: v[1] for v in DTYPES.values()}[header['dtype']]
+    item_size = array(array_type).itemsize
+
+    def restore(value):
+        if isinstance(value, dict):
+            if set(value.keys()) == {'$column'}:
+                offset, length = header['columns'][value['$column']]
+                a = array(array_type)
+                a.frombytes(body[offset:offset + length * item_size])
+                if sys.byteorder == 'big':
+                    a.byteswap()
+                return [None if math.isnan(v) else v for v in a]
+            return {k: restore(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [restore(v) for v in value]
+        return value
+
+    return restore(header['objects'])
+
+
+def compress_telemetry(telemetry: MutableSequence[Mapping[str, Any]]) -> bytes:
+    """
+    Encodes telemetry as float64 columns and compresses it for storage
+    """
+    return zlib.compress(encode_telemetry(telemetry), 6)
+
+
+def decompress_telemetry(data: bytes) -> bytes:
+    """
+    :return: the encoded (but no longer compressed) telemetry
+    """
+    return zlib.decompress(bytes(data))
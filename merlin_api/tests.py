@@ -1,7 +1,22 @@
+from datetime import timedelta
 from typing import List
-from django.test import TestCase
-from . import pymerlin_adapter
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from . import bulk, checkpoints, jobs, pymerlin_adapter, result_cache, synthetic
 from .models import *
+from .sim_cache import (
+    RevisionCache, checkpoint_cache, scenario_cache, simulation_cache)
+from .telemetry import decode_telemetry
+from .middleware import normalize_sql
+from .serializers import SimulationSerializer, get_prefetch_lookups
+from .checks import check_process_classes
+from .process_registry import process_registry
+from .views import SimulationRunViewSet
+from .warmup import warmup
 from pymerlin.processes import *
 from examples import RecordStorageFacility
 from examples import DIAServicesModel
@@ -84,6 +99,18 @@ def create_test_scenarios() -> List[merlin.Scenario]:
 
 
 
+def create_salary_scenario(
+        dsim: Simulation, time: int, value: float=2.0) -> Scenario:
+    # stores a scenario that sets the call center staff salary at time
+    msim = pymerlin_adapter.django2pymerlin(dsim)
+    e = msim.get_entity_by_name('call center')
+    prop = e.get_process_by_name('Call Center Staff').get_prop('staff salary')
+    event = merlin.Event.create(
+        time, "Entity {0} := Property {1}, {2}".format(e.id, prop.id, value))
+    return pymerlin_adapter.pymerlin_scenario2django(
+        merlin.Scenario({event}, sim=msim, name='salary'), dsim)
+
+
 class EntityModelTest(TestCase):
 
     def setUp(self):
@@ -558,15 +585,981 @@ class ScenarioAndEventTest(TestCase):
             self.assertAlmostEqual(expected_result[i], od['data']['value'][i])
 
 
+class SimulationCacheTest(TestCase):
+
+    def setUp(self):
+        simulation_cache.clear()
+        sim_id = pymerlin_adapter.pymerlin2django(create_test_simulation())
+        self.dsim = Simulation.objects.get(pk=sim_id)
+
+    def tearDown(self):
+        simulation_cache.clear()
+
+    def test_cached_hydration(self):
+        first = pymerlin_adapter.get_pymerlin_simulation(self.dsim)
+        self.assertEqual(len(simulation_cache), 1)
+        with self.assertNumQueries(0):
+            second = pymerlin_adapter.get_pymerlin_simulation(self.dsim)
+        self.assertIsNot(first, second)
+        self.assertEqual(
+            {e.id for e in first.get_entities()},
+            {e.id for e in second.get_entities()})
+
+    def test_large_model(self):
+        # a cache hit must not copy the graph recursively
+        sim_id = bulk.import_simulation(
+            synthetic.create_synthetic_simulation(10000, fan_out=2, depth=4))
+        dsim = Simulation.objects.get(pk=sim_id)
+        first = pymerlin_adapter.get_pymerlin_simulation(dsim)
+        with self.assertNumQueries(0):
+            second = pymerlin_adapter.get_pymerlin_simulation(dsim)
+        self.assertIsNot(first, second)
+        self.assertEqual(len(second.get_entities()), 10000)
+
+    def test_revision_bumped_on_write(self):
+        pymerlin_adapter.get_pymerlin_simulation(self.dsim)
+        pp = ProcessProperty.objects.filter(
+            process__parent__sim=self.dsim)[0]
+        pp.property_value = 1.0
+        pp.save()
+        self.assertEqual(len(simulation_cache), 0)
+
+        # the owning simulation is resolved from the loaded parents
+        pp = ProcessProperty.objects.select_related('process__parent').get(
+            pk=pp.pk)
+        pp.property_value = 2.0
+        with CaptureQueriesContext(connection) as ctx:
+            pp.save()
+        self.assertFalse(any(
+            q['sql'].startswith('SELECT') for q in ctx.captured_queries))
+        updated = Simulation.objects.get(pk=self.dsim.id)
+        self.assertGreater(updated.revision, self.dsim.revision)
+
+    def test_layout_save_keeps_cache(self):
+        pymerlin_adapter.get_pymerlin_simulation(self.dsim)
+        e = Entity.objects.filter(sim=self.dsim)[0]
+        e.display_pos_x = 3.0
+        with CaptureQueriesContext(connection) as ctx:
+            e.save()
+        # compared with the loaded values, not the stored row
+        self.assertFalse(any(
+            q['sql'].startswith('SELECT') for q in ctx.captured_queries))
+        self.assertEqual(len(simulation_cache), 1)
+        updated = Simulation.objects.get(pk=self.dsim.id)
+        self.assertEqual(updated.revision, self.dsim.revision)
+        self.assertEqual(
+            updated.layout_revision, self.dsim.layout_revision + 1)
+
+        e.name = 'renamed'
+        e.save()
+        self.assertEqual(len(simulation_cache), 0)
+
+    def test_save_with_unused_pk_inserts(self):
+        sim = Simulation(pk=self.dsim.id + 1000, name='fixture')
+        sim.save()
+        self.assertEqual(
+            Simulation.objects.get(pk=self.dsim.id + 1000).name, 'fixture')
+
+    def test_lru_eviction(self):
+        cache = RevisionCache(2)
+        for i in range(3):
+            cache.put(i, 0, create_test_simulation())
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(0, 0))
+        self.assertIsNotNone(cache.get(2, 0))
+        self.assertIsNone(cache.get(2, 1))
+
+
+class ResultCacheTest(TestCase):
+
+    def setUp(self):
+        sim_id = pymerlin_adapter.pymerlin2django(create_test_simulation())
+        self.dsim = Simulation.objects.get(pk=sim_id)
+        self.scenario = Scenario.objects.create(sim=self.dsim, name='s')
+
+    def test_cached_run(self):
+        result = pymerlin_adapter.run_simulation(self.dsim, [self.scenario])
+        with self.assertNumQueries(0):
+            cached = pymerlin_adapter.run_simulation(
+                self.dsim, [self.scenario])
+        self.assertEqual(result, cached)
+
+    def test_key_follows_revisions(self):
+        key = result_cache.telemetry_key(self.dsim, [self.scenario], 10)
+        self.assertNotEqual(
+            key, result_cache.telemetry_key(self.dsim, [self.scenario], 5))
+        Event.objects.create(scenario=self.scenario, time=2, actions=[])
+        scenario = Scenario.objects.get(pk=self.scenario.id)
+        self.assertNotEqual(
+            key, result_cache.telemetry_key(self.dsim, [scenario], 10))
+
+
+class SimulationJobTest(TestCase):
+
+    def setUp(self):
+        self.sim_id = pymerlin_adapter.pymerlin2django(
+            create_test_simulation())
+
+    def test_queue_and_run(self):
+        response = self.client.post(
+            '/api/simulation-jobs/',
+            content_type='application/json',
+            data=json.dumps({'sim': self.sim_id, 'steps': 5}))
+        self.assertEqual(response.status_code, 201)
+        job_id = json.loads(response.content.decode('utf-8'))['id']
+        self.assertEqual(jobs.run_worker(once=True), 1)
+        self.assertIsNone(jobs.claim_next_job())
+
+        response = self.client.get('/api/simulation-jobs/{0}/'.format(job_id))
+        j = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(j['status'], SimulationJob.DONE)
+        self.assertTrue(len(j['result']) > 0)
+        self.assertEqual(
+            SimulationRun.objects.get(pk=j['run']).steps, 5)
+
+    def test_requeue_stale(self):
+        job = SimulationJob.objects.create(
+            sim_id=self.sim_id,
+            status=SimulationJob.RUNNING,
+            started=timezone.now() - timedelta(hours=2))
+        self.assertEqual(jobs.requeue_stale_jobs(60), 1)
+        self.assertEqual(jobs.requeue_stale_jobs(60), 0)
+        self.assertEqual(jobs.run_worker(once=True, job_timeout=60), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, SimulationJob.DONE)
+
+    def test_foreign_scenario_rejected(self):
+        other_id = pymerlin_adapter.pymerlin2django(create_test_simulation())
+        scenario = Scenario.objects.create(sim_id=other_id, name='other')
+        response = self.client.post(
+            '/api/simulation-jobs/',
+            content_type='application/json',
+            data=json.dumps({'sim': self.sim_id, 'scenarios': [scenario.id]}))
+        self.assertEqual(response.status_code, 400)
+
+
+class SimulationBatchTest(TestCase):
+
+    def setUp(self):
+        test_sim = create_test_simulation()
+        sim_id = pymerlin_adapter.pymerlin2django(test_sim)
+        self.dsim = Simulation.objects.get(pk=sim_id)
+        msim = pymerlin_adapter.django2pymerlin(self.dsim)
+        e = msim.get_entity_by_name('call center')
+        prop = e.get_process_by_name('Call Center Staff').get_prop(
+            'staff salary')
+        event = merlin.Event.create(
+            5, "Entity {0} := Property {1}, 2.0".format(e.id, prop.id))
+        self.scenario = pymerlin_adapter.pymerlin_scenario2django(
+            merlin.Scenario({event}, sim=msim, name='s'), self.dsim)
+
+    def test_batch_matches_single_runs(self):
+        variants = [[], [self.scenario.id]]
+        response = self.client.post(
+            '/api/simulation-run/{0}/batch/'.format(self.dsim.id),
+            content_type='application/json',
+            data=json.dumps({'variants': variants}))
+        self.assertEqual(response.status_code, 200)
+        j = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(len(j['variants']), 2)
+        for v in j['variants']:
+            single = self.client.get(
+                '/api/simulation-run/{0}/'.format(self.dsim.id),
+                {'s{0}'.format(i): s_id for i, s_id in enumerate(v['scenarios'])})
+            self.assertEqual(
+                v['telemetry'], json.loads(single.content.decode('utf-8')))
+
+    def test_unknown_scenario(self):
+        response = self.client.post(
+            '/api/simulation-run/{0}/batch/'.format(self.dsim.id),
+            content_type='application/json',
+            data=json.dumps({'variants': [[0]]}))
+        self.assertEqual(response.status_code, 400)
+
+
+class SimulationSweepTest(TestCase):
+
+    def setUp(self):
+        sim_id = pymerlin_adapter.pymerlin2django(create_test_simulation())
+        self.dsim = Simulation.objects.get(pk=sim_id)
+        self.salary = ProcessProperty.objects.get(
+            process__parent__sim=self.dsim, name='staff salary')
+
+    def test_expand_grid(self):
+        overrides = pymerlin_adapter.expand_property_grid(
+            {2: [1.0, 2.0], 1: [3.0, 4.0, 5.0]})
+        self.assertEqual(len(overrides), 6)
+        self.assertEqual(overrides[0], {1: 3.0, 2: 1.0})
+        self.assertEqual(overrides[-1], {1: 5.0, 2: 2.0})
+
+    def test_sweep(self):
+        values = [self.salary.property_value, 1000.0]
+        response = self.client.post(
+            '/api/simulation-run/{0}/sweep/'.format(self.dsim.id),
+            content_type='application/json',
+            data=json.dumps({'grid': {str(self.salary.id): values}}))
+        self.assertEqual(response.status_code, 200)
+        cube = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(len(cube['data']), 2)
+        self.assertEqual(len(cube['outputs']), 1)
+        self.assertEqual(len(cube['data'][0][0]), self.dsim.num_steps)
+        expected_result = \
+            [20.0, 40.0, 60.0, 80.0, 100.0, 100.0, 100.0, 100.0, 100.0, 100.0]
+        for i in range(0, len(expected_result)):
+            self.assertAlmostEqual(expected_result[i], cube['data'][0][0][i])
+        self.assertNotEqual(cube['data'][0], cube['data'][1])
+        # the database is left untouched
+        self.assertEqual(
+            ProcessProperty.objects.get(pk=self.salary.id).property_value,
+            values[0])
+
+    def test_unknown_property(self):
+        response = self.client.post(
+            '/api/simulation-run/{0}/sweep/'.format(self.dsim.id),
+            content_type='application/json',
+            data=json.dumps({'variants': [{'0': 1.0}]}))
+        self.assertEqual(response.status_code, 400)
+
 
+class TelemetryFormatTest(TestCase):
 
+    def setUp(self):
+        self.sim_id = pymerlin_adapter.pymerlin2django(
+            create_test_simulation())
+
+    def test_ndjson(self):
+        url = '/api/simulation-run/{0}/'.format(self.sim_id)
+        expected = json.loads(self.client.get(url).content.decode('utf-8'))
+        response = self.client.get(url, {'format': 'ndjson'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode('utf-8')
+        self.assertEqual(
+            [json.loads(l) for l in lines.splitlines()], expected)
 
+    def test_binary(self):
+        url = '/api/simulation-run/{0}/'.format(self.sim_id)
+        expected = json.loads(self.client.get(url).content.decode('utf-8'))
+        response = self.client.get(
+            url, HTTP_ACCEPT='application/vnd.merlin.telemetry')
+        self.assertEqual(
+            response['Content-Type'], 'application/vnd.merlin.telemetry')
+        self.assertEqual(decode_telemetry(response.content), expected)
+        response = self.client.get(url, {'format': 'bin', 'dtype': 'float32'})
+        self.assertLess(
+            len(response.content), len(json.dumps(expected)))
 
 
+class SimulationRunStorageTest(TestCase):
+
+    def setUp(self):
+        self.sim_id = pymerlin_adapter.pymerlin2django(
+            create_test_simulation())
+
+    def test_save_and_fetch(self):
+        response = self.client.get(
+            '/api/simulation-run/{0}/'.format(self.sim_id), {'save': 'true'})
+        telemetry = json.loads(response.content.decode('utf-8'))
+        run_id = int(response['X-Run-Id'])
+
+        listed = json.loads(self.client.get(
+            '/api/runs/', {'sim': self.sim_id}).content.decode('utf-8'))
+        self.assertEqual([r['id'] for r in listed], [run_id])
+        self.assertNotIn('telemetry', listed[0])
+
+        stored = json.loads(self.client.get(
+            '/api/runs/{0}/'.format(run_id)).content.decode('utf-8'))
+        self.assertEqual(stored['telemetry'], telemetry)
+        run = SimulationRun.objects.get(pk=run_id)
+        self.assertLess(len(run.telemetry), len(json.dumps(telemetry)))
+        self.assertIsNotNone(run.duration)
+
+        # served from the result cache, nothing was simulated
+        response = self.client.get(
+            '/api/simulation-run/{0}/'.format(self.sim_id), {'save': 'true'})
+        run = SimulationRun.objects.get(pk=int(response['X-Run-Id']))
+        self.assertIsNone(run.duration)
+
+    def test_binary_dtype(self):
+        response = self.client.get(
+            '/api/simulation-run/{0}/'.format(self.sim_id), {'save': 'true'})
+        url = '/api/runs/{0}/'.format(response['X-Run-Id'])
+        float64 = self.client.get(url, {'format': 'bin'}).content
+        float32 = self.client.get(
+            url, {'format': 'bin', 'dtype': 'float32'}).content
+        self.assertLess(len(float32), len(float64))
+        self.assertEqual(
+            len(decode_telemetry(float32)), len(decode_telemetry(float64)))
+
+    def test_pagination(self):
+        for _ in range(3):
+            self.client.get(
+                '/api/simulation-run/{0}/'.format(self.sim_id),
+                {'save': 'true'})
+        response = self.client.get('/api/runs/', {'page_size': 2})
+        ids = [r['id'] for r in response.data['results']]
+        response = self.client.get(response.data['next'])
+        ids += [r['id'] for r in response.data['results']]
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(
+            ids, list(SimulationRun.objects.order_by('-created').values_list(
+                'id', flat=True)))
 
+    def test_invalid_sim_filter(self):
+        response = self.client.get('/api/runs/', {'sim': 'abc'})
+        self.assertEqual(response.status_code, 400)
 
 
+class CheckpointTest(TestCase):
 
+    def setUp(self):
+        checkpoint_cache.clear()
+        sim_id = pymerlin_adapter.pymerlin2django(create_test_simulation())
+        self.dsim = Simulation.objects.get(pk=sim_id)
+
+    def tearDown(self):
+        checkpoint_cache.clear()
+
+    def test_resume_matches_full_run(self):
+        specs = [pymerlin_adapter.django_scenario2spec(
+            create_salary_scenario(self.dsim, 5, 1000.0))]
+        full = pymerlin_adapter.run_checkpointed(self.dsim, specs)
+        with self.settings(MERLIN_CHECKPOINT_INTERVAL=3):
+            first = pymerlin_adapter.run_checkpointed(self.dsim, specs)
+            self.assertEqual(len(checkpoint_cache), 3)
+            resumed = pymerlin_adapter.run_checkpointed(self.dsim, specs)
+        self.assertEqual(full, first)
+        self.assertEqual(full, resumed)
+
+    def test_events_fingerprint(self):
+        early = pymerlin_adapter.django_scenario2spec(
+            create_salary_scenario(self.dsim, 5))
+        late = pymerlin_adapter.django_scenario2spec(
+            create_salary_scenario(self.dsim, 8))
+        self.assertEqual(
+            checkpoints.events_fingerprint([early], 4),
+            checkpoints.events_fingerprint([late], 4))
+        self.assertNotEqual(
+            checkpoints.events_fingerprint([early], 6),
+            checkpoints.events_fingerprint([late], 6))
+
+    def test_same_step_events(self):
+        spec = {'start_offset': 0, 'events': [
+            {'time': 2, 'actions': [{'op': 'set', 'value': 1.0}]},
+            {'time': 2, 'actions': [{'op': 'add', 'value': 2.0}]}]}
+        swapped = dict(spec, events=list(reversed(spec['events'])))
+        self.assertEqual(
+            checkpoints.events_fingerprint([spec], 2),
+            checkpoints.events_fingerprint([swapped], 2))
+
+    def test_resume_with_same_step_events(self):
+        spec = pymerlin_adapter.django_scenario2spec(
+            create_salary_scenario(self.dsim, 5, 1000.0))
+        other = pymerlin_adapter.django_scenario2spec(
+            create_salary_scenario(self.dsim, 5, 1000.0))
+        spec['events'] += other['events']
+        full = pymerlin_adapter.run_checkpointed(self.dsim, [spec])
+        with self.settings(MERLIN_CHECKPOINT_INTERVAL=3):
+            first = pymerlin_adapter.run_checkpointed(self.dsim, [spec])
+            resumed = pymerlin_adapter.run_checkpointed(self.dsim, [spec])
+        self.assertEqual(full, first)
+        self.assertEqual(full, resumed)
+
+
+class ScenarioComparisonTest(TestCase):
+
+    def setUp(self):
+        sim_id = pymerlin_adapter.pymerlin2django(create_test_simulation())
+        self.dsim = Simulation.objects.get(pk=sim_id)
+        self.early = create_salary_scenario(self.dsim, 3, 1000.0)
+        self.late = create_salary_scenario(self.dsim, 7, 1000.0)
+
+    def test_compare_matches_single_runs(self):
+        url = '/api/simulation-run/{0}/'.format(self.dsim.id)
+        response = self.client.get(
+            url + 'compare/', {'s0': self.early.id, 's1': self.late.id})
+        j = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(
+            j['baseline'],
+            json.loads(self.client.get(url).content.decode('utf-8')))
+        self.assertEqual(
+            [s['id'] for s in j['scenarios']], [self.early.id, self.late.id])
+        for s in j['scenarios']:
+            single = self.client.get(url, {'s0': s['id']})
+            self.assertEqual(
+                s['telemetry'], json.loads(single.content.decode('utf-8')))
+
+
+@override_settings(MERLIN_QUERY_PROFILE=True)
+class QueryProfileTest(TestCase):
+
+    def setUp(self):
+        pymerlin_adapter.pymerlin2django(create_test_simulation())
 
+    def test_headers(self):
+        response = self.client.get('/api/entities/')
+        self.assertGreater(int(response['X-Query-Count']), 0)
+        self.assertGreaterEqual(float(response['X-Query-Time']), 0.0)
+        self.assertGreaterEqual(int(response['X-Query-Duplicates']), 1)
 
+    def test_disabled(self):
+        with self.settings(MERLIN_QUERY_PROFILE=False):
+            response = self.client.get('/api/entities/')
+        self.assertNotIn('X-Query-Count', response)
 
+    def test_normalize_sql(self):
+        self.assertEqual(
+            normalize_sql(
+                "SELECT * FROM t WHERE id = 12 AND name = 'it''s' AND x = 1.5"),
+            "SELECT * FROM t WHERE id = ? AND name = ? AND x = ?")
+
+
+class SyntheticHydrationTest(TestCase):
+
+    def test_fan_out_endpoint_mapping(self):
+        sim_id = pymerlin_adapter.pymerlin2django(
+            synthetic.create_synthetic_simulation(20, fan_out=3))
+        dsim = Simulation.objects.prefetch_related(
+            *pymerlin_adapter.SIMULATION_GRAPH_PREFETCH).get(pk=sim_id)
+        msim = pymerlin_adapter.django2pymerlin(dsim)
+        endpoint_ids = set()
+        for e in msim.get_entities():
+            for o in e.outputs:
+                for mep in o.get_endpoint_objects():
+                    endpoint_ids.add(mep.id)
+                    ep = Endpoint.objects.get(pk=mep.id)
+                    self.assertEqual(ep.parent_id, o.id)
+                    self.assertEqual(
+                        mep.connector.id, ep.input_id or ep.sim_output_id)
+        self.assertEqual(
+            endpoint_ids,
+            set(Endpoint.objects.filter(
+                parent__parent__sim_id=sim_id).values_list('id', flat=True)))
+
+    def test_synthetic_scenarios_run(self):
+        msim = synthetic.create_synthetic_simulation(
+            30, fan_out=2, fan_in=2, depth=2, processes_per_entity=2)
+        self.assertEqual(
+            len([e for e in msim.get_entities() if e.parent]), 20)
+        sim_id = bulk.import_simulation(msim)
+        dsim = Simulation.objects.get(pk=sim_id)
+        self.assertEqual(
+            Process.objects.filter(parent__sim=dsim).count(), 60)
+        hydrated = pymerlin_adapter.django2pymerlin(
+            Simulation.objects.prefetch_related(
+                *pymerlin_adapter.SIMULATION_GRAPH_PREFETCH).get(pk=sim_id))
+        for s in synthetic.create_synthetic_scenarios(hydrated, 2, 5):
+            pymerlin_adapter.pymerlin_scenario2django(s, dsim)
+        for ds in Scenario.objects.filter(sim=dsim):
+            self.assertIsInstance(
+                pymerlin_adapter.run_simulation(dsim, [ds]), list)
+
+
+class BulkImportTest(TestCase):
+
+    def assert_same_model(self, sim_id, bulk_id):
+        # compare the row counts of every table and the run results
+        for model, lookup in [
+                (Attribute, 'sim'),
+                (UnitType, 'sim'),
+                (Output, 'sim'),
+                (Entity, 'sim'),
+                (Entity, 'parent__sim'),
+                (OutputConnector, 'parent__sim'),
+                (InputConnector, 'parent__sim'),
+                (InputConnector, 'source__parent__sim'),
+                (SimOutputConnector, 'parent__sim'),
+                (Endpoint, 'parent__parent__sim'),
+                (Process, 'parent__sim'),
+                (ProcessProperty, 'process__parent__sim')]:
+            self.assertEqual(
+                model.objects.filter(**{lookup: sim_id}).count(),
+                model.objects.filter(**{lookup: bulk_id}).count(),
+                '{0} by {1}'.format(model.__name__, lookup))
+        self.assertEqual(
+            set(InputConnector.objects.filter(
+                parent__sim=sim_id).values_list('name', 'description')),
+            set(InputConnector.objects.filter(
+                parent__sim=bulk_id).values_list('name', 'description')))
+
+        def outputs(pk):
+            telemetry = pymerlin_adapter.run_simulation(
+                Simulation.objects.get(pk=pk))
+            return sorted(
+                json.dumps(t['data'], sort_keys=True)
+                for t in telemetry if t['type'] == 'Output')
+        self.assertEqual(outputs(sim_id), outputs(bulk_id))
+
+    def test_bulk_import(self):
+        self.assert_same_model(
+            pymerlin_adapter.pymerlin2django(create_test_simulation()),
+            bulk.import_simulation(create_test_simulation(), use_copy=False))
+
+    def test_copy_import(self):
+        self.assert_same_model(
+            pymerlin_adapter.pymerlin2django(
+                RecordStorageFacility.govRecordStorage()),
+            bulk.import_simulation(
+                RecordStorageFacility.govRecordStorage(), use_copy=True))
+
+
+
+@override_settings(MERLIN_QUERY_PROFILE=True)
+class SimulationPrefetchTest(TestCase):
+
+    def create_sim(self, num_entities, num_scenarios):
+        msim = synthetic.create_synthetic_simulation(
+            num_entities, depth=1, processes_per_entity=1, num_outputs=2)
+        sim_id = bulk.import_simulation(msim)
+        dsim = Simulation.objects.get(pk=sim_id)
+        hydrated = pymerlin_adapter.django2pymerlin(
+            Simulation.objects.prefetch_related(
+                *pymerlin_adapter.SIMULATION_GRAPH_PREFETCH).get(pk=sim_id))
+        for s in synthetic.create_synthetic_scenarios(
+                hydrated, num_scenarios, 3):
+            pymerlin_adapter.pymerlin_scenario2django(s, dsim)
+        return sim_id
+
+    def test_prefetch_lookups(self):
+        lookups = get_prefetch_lookups(SimulationSerializer)
+        self.assertIsInstance(lookups, tuple)
+        for lookup in [
+                'entities__outputs__endpoints',
+                'entities__outputs__unit_type',
+                'entities__processes__properties',
+                'entities__children',
+                'outputs__inputs',
+                'scenarios__events']:
+            self.assertIn(lookup, lookups)
+        self.assertNotIn('entities__sim', lookups)
+
+    def test_constant_query_count(self):
+        counts = list()
+        for num_entities, num_scenarios in [(4, 1), (40, 4)]:
+            sim_id = self.create_sim(num_entities, num_scenarios)
+            response = self.client.get('/api/simulations/{0}/'.format(sim_id))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                len(response.data['entities']), num_entities)
+            counts.append(int(response['X-Query-Count']))
+        self.assertEqual(counts[0], counts[1])
+
+
+class FastSerializationTest(TestCase):
+
+    def setUp(self):
+        sim_id = pymerlin_adapter.pymerlin2django(create_test_simulation())
+        self.dsim = Simulation.objects.get(pk=sim_id)
+        create_salary_scenario(self.dsim, 2)
+
+    def canonical(self, value):
+        # related objects come back in table order, compare them unordered
+        if isinstance(value, dict):
+            return {k: self.canonical(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return sorted(
+                [self.canonical(v) for v in value],
+                key=lambda v: json.dumps(v, sort_keys=True))
+        return value
+
+    def get(self, query=''):
+        response = self.client.get(
+            '/api/simulations/{0}/{1}'.format(self.dsim.id, query))
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content.decode('utf-8'))
+
+    def test_fast_matches_serializer(self):
+        self.assertEqual(
+            self.canonical(self.get('?view=fast')),
+            self.canonical(self.get()))
+
+    def test_compact(self):
+        data = self.get('?view=compact')
+        entity = [e for e in data['entities'] if e['parent'] is None][0]
+        self.assertEqual(entity['sim'], self.dsim.id)
+        for o in entity['outputs']:
+            self.assertEqual(o['parent'], entity['id'])
+        self.assertEqual(
+            data['scenarios'][0]['events'][0]['scenario'],
+            data['scenarios'][0]['id'])
+
+
+class SimulationListTest(TestCase):
+
+    def setUp(self):
+        self.sim_ids = [
+            pymerlin_adapter.pymerlin2django(create_test_simulation())
+            for _ in range(3)]
+        create_salary_scenario(Simulation.objects.get(pk=self.sim_ids[0]), 2)
+
+    def test_summary_counts(self):
+        response = self.client.get('/api/simulations/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 3)
+        summaries = {s['id']: s for s in response.data['results']}
+        first = summaries[self.sim_ids[0]]
+        self.assertNotIn('entities', first)
+        self.assertEqual(first['num_entities'], 3)
+        self.assertEqual(first['num_outputs'], 1)
+        self.assertEqual(first['num_processes'], 3)
+        self.assertEqual(first['num_scenarios'], 1)
+        self.assertEqual(summaries[self.sim_ids[1]]['num_scenarios'], 0)
+
+    def test_pagination(self):
+        response = self.client.get('/api/simulations/?page_size=2')
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNotNone(response.data['next'])
+        response = self.client.get('/api/simulations/?page_size=2&page=2')
+        self.assertEqual(
+            [s['id'] for s in response.data['results']], self.sim_ids[2:])
+
+
+class ConditionalGetTest(TestCase):
+
+    def setUp(self):
+        sim_id = pymerlin_adapter.pymerlin2django(create_test_simulation())
+        self.dsim = Simulation.objects.get(pk=sim_id)
+        self.scenario = create_salary_scenario(self.dsim, 2)
+
+    def assert_not_modified(self, url, etag):
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_simulation_detail(self):
+        url = '/api/simulations/{0}/'.format(self.dsim.id)
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assert_not_modified(url, etag)
+
+        e = Entity.objects.filter(sim=self.dsim)[0]
+        e.name = 'renamed'
+        e.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        etag = response['ETag']
+
+        Event.objects.create(scenario=self.scenario, time=3, actions=[])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        fast = self.client.get(url + '?view=fast')
+        self.assertNotEqual(fast['ETag'], response['ETag'])
+
+    def test_simulation_run(self):
+        url = '/api/simulation-run/{0}/?s0={1}'.format(
+            self.dsim.id, self.scenario.id)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        Event.objects.create(scenario=self.scenario, time=3, actions=[])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(MERLIN_QUERY_PROFILE=True)
+class SparseFieldsTest(TestCase):
+
+    def setUp(self):
+        pymerlin_adapter.pymerlin2django(create_test_simulation())
+
+    def test_fields(self):
+        response = self.client.get(
+            '/api/entities/?fields=id,display_pos_x,display_pos_y')
+        self.assertEqual(len(response.data), 3)
+        for e in response.data:
+            self.assertEqual(
+                set(e.keys()), {'id', 'display_pos_x', 'display_pos_y'})
+        self.assertEqual(int(response['X-Query-Count']), 1)
+
+    def test_nested(self):
+        response = self.client.get('/api/entities/?fields=id,outputs')
+        outputs = [o for e in response.data for o in e['outputs']]
+        self.assertTrue(outputs)
+        self.assertTrue(all(isinstance(o, int) for o in outputs))
+
+        response = self.client.get(
+            '/api/entities/?fields=id,outputs&expand=outputs')
+        outputs = [o for e in response.data for o in e['outputs']]
+        self.assertTrue(all('endpoints' in o for o in outputs))
+        self.assertTrue(
+            all(isinstance(ep, int) for o in outputs for ep in o['endpoints']))
+
+        response = self.client.get('/api/entities/?fields=outputs.name')
+        outputs = [o for e in response.data for o in e['outputs']]
+        self.assertTrue(all(set(o.keys()) == {'name'} for o in outputs))
+
+    def test_nested_only(self):
+        response = self.client.get('/api/entities/?fields=id,outputs.name')
+        self.assertTrue([o for e in response.data for o in e['outputs']])
+        # the entities and their outputs, no deferred column is loaded later
+        self.assertEqual(int(response['X-Query-Count']), 2)
+
+    def test_cursor_pagination(self):
+        response = self.client.get('/api/entities/')
+        self.assertIsInstance(response.data, list)
+
+        response = self.client.get('/api/entities/?page_size=2&fields=id')
+        ids = [e['id'] for e in response.data['results']]
+        self.assertEqual(len(ids), 2)
+        response = self.client.get(response.data['next'])
+        ids += [e['id'] for e in response.data['results']]
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(
+            ids, list(Entity.objects.order_by('id').values_list(
+                'id', flat=True)))
+
+
+class LayoutTest(TestCase):
+
+    def setUp(self):
+        sim_id = pymerlin_adapter.pymerlin2django(create_test_simulation())
+        self.dsim = Simulation.objects.get(pk=sim_id)
+        other_id = pymerlin_adapter.pymerlin2django(create_test_simulation())
+        self.other = Entity.objects.filter(sim_id=other_id)[0]
+
+    def test_layout(self):
+        entities = list(Entity.objects.filter(sim=self.dsim))
+        output = Output.objects.get(sim=self.dsim)
+        revision = Simulation.objects.get(pk=self.dsim.id).revision
+        data = {
+            'entities': [
+                {'id': e.id, 'x': float(i), 'y': 2.0 * i}
+                for i, e in enumerate(entities)] +
+                [{'id': self.other.id, 'x': 1.0, 'y': 1.0}],
+            'outputs': [{'id': output.id, 'x': 5.0, 'y': None}],
+        }
+        response = self.client.post(
+            '/api/simulations/{0}/layout/'.format(self.dsim.id),
+            content_type='application/json',
+            data=json.dumps(data))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data, {'entities': len(entities), 'outputs': 1})
+        for i, e in enumerate(entities):
+            e.refresh_from_db()
+            self.assertEqual((e.display_pos_x, e.display_pos_y), (i, 2.0 * i))
+        output.refresh_from_db()
+        self.assertEqual(output.display_pos_x, 5.0)
+        self.assertIsNone(output.display_pos_y)
+        self.other.refresh_from_db()
+        self.assertIsNone(self.other.display_pos_x)
+        updated = Simulation.objects.get(pk=self.dsim.id)
+        self.assertEqual(updated.revision, revision)
+        self.assertEqual(
+            updated.layout_revision, self.dsim.layout_revision + 1)
+
+
+class BulkDeleteTest(TestCase):
+
+    def setUp(self):
+        sim_id = pymerlin_adapter.pymerlin2django(
+            RecordStorageFacility.govRecordStorage())
+        self.dsim = Simulation.objects.get(pk=sim_id)
+        self.other_id = pymerlin_adapter.pymerlin2django(
+            create_test_simulation())
+        scenario = create_salary_scenario(
+            Simulation.objects.get(pk=self.other_id), 2)
+        scenario.sim = self.dsim
+        scenario.save()
+        self.phase = ProjectPhase.objects.create(
+            project=Project.objects.create(name='p'), scenario=scenario)
+        result = pymerlin_adapter.run_simulation(self.dsim, [])
+        run = pymerlin_adapter.save_simulation_run(self.dsim, [], -1, result)
+        SimulationJob.objects.create(
+            sim=self.dsim, run=run, status=SimulationJob.DONE)
+
+    def assert_deleted(self):
+        for model, lookup in bulk.DELETE_ORDER:
+            self.assertFalse(
+                model.objects.filter(**{lookup: self.dsim.id}).exists())
+        self.assertTrue(
+            Entity.objects.filter(sim_id=self.other_id).exists())
+        self.assertTrue(
+            UnitType.objects.filter(sim_id=self.other_id).exists())
+        self.phase.refresh_from_db()
+        self.assertIsNone(self.phase.scenario)
+
+    def test_destroy(self):
+        response = self.client.delete(
+            '/api/simulations/{0}/'.format(self.dsim.id))
+        self.assertEqual(response.status_code, 204)
+        self.assert_deleted()
+
+    def test_delete_job(self):
+        response = self.client.delete(
+            '/api/simulations/{0}/?async=true'.format(self.dsim.id))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['kind'], SimulationJob.DELETE)
+        self.assertEqual(jobs.run_worker(once=True), 1)
+        self.assert_deleted()
+        job = SimulationJob.objects.get(pk=response.data['id'])
+        self.assertEqual(job.status, SimulationJob.DONE)
+        self.assertIsNone(job.sim_id)
+        self.assertEqual(job.result['sim'], self.dsim.id)
+        self.assertGreater(job.result['deleted']['Entity'], 0)
+
+    def test_running_job_outlives_sim(self):
+        job = SimulationJob.objects.create(
+            sim=self.dsim, status=SimulationJob.RUNNING)
+        bulk.delete_simulation(self.dsim.id)
+        self.assert_deleted()
+        # the worker still holds the job with the sim it claimed
+        jobs.execute_job(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, SimulationJob.FAILED)
+        self.assertIsNone(job.sim_id)
+
+
+class CloneTest(TestCase):
+
+    def setUp(self):
+        sim_id = pymerlin_adapter.pymerlin2django(
+            RecordStorageFacility.govRecordStorage())
+        self.dsim = Simulation.objects.get(pk=sim_id)
+
+    def test_clone(self):
+        other_id = pymerlin_adapter.pymerlin2django(create_test_simulation())
+        create_salary_scenario(Simulation.objects.get(pk=other_id), 2)
+        response = self.client.post(
+            '/api/simulations/{0}/clone/'.format(other_id),
+            content_type='application/json',
+            data=json.dumps({'name': 'copy', 'scenarios': True}))
+        self.assertEqual(response.status_code, 201)
+        clone = Simulation.objects.get(pk=response.data['id'])
+        self.assertEqual(clone.name, 'copy')
+
+        # the copy is a separate graph that runs like the original
+        self.assertFalse(Entity.objects.filter(
+            sim=clone, outputs__endpoints__input__parent__sim_id=other_id
+        ).exists())
+        self.assertFalse(InputConnector.objects.filter(
+            parent__sim=clone).exclude(source__parent__sim=clone).exists())
+        original = Scenario.objects.get(sim_id=other_id)
+        copied = Scenario.objects.get(sim=clone)
+        self.assertNotEqual(
+            original.events.get().actions, copied.events.get().actions)
+
+        def outputs(sim, scenario):
+            telemetry = pymerlin_adapter.run_simulation(sim, [scenario])
+            return sorted(
+                json.dumps(t['data'], sort_keys=True)
+                for t in telemetry if t['type'] == 'Output')
+        self.assertEqual(
+            outputs(clone, copied),
+            outputs(Simulation.objects.get(pk=other_id), original))
+
+    def test_clone_counts(self):
+        clone_id = bulk.clone_simulation(self.dsim.id)
+        for model, lookup in bulk.CLONE_ORDER:
+            self.assertEqual(
+                model.objects.filter(**{lookup: clone_id}).count(),
+                model.objects.filter(**{lookup: self.dsim.id}).count())
+        self.assertEqual(
+            Entity.objects.filter(sim_id=clone_id, parent__isnull=False)
+            .exclude(parent__sim_id=clone_id).count(), 0)
+        self.assertEqual(Scenario.objects.filter(sim_id=clone_id).count(), 0)
+
+
+class ProcessRegistryTest(TestCase):
+
+    def test_registry(self):
+        name = pymerlin_adapter.get_fullname_from_process_class(BudgetProcess)
+        self.assertIn(name, process_registry.classes())
+        self.assertIs(process_registry.get(name), BudgetProcess)
+        self.assertIs(process_registry.get('BudgetProcess'), BudgetProcess)
+        with self.assertRaises(ValueError):
+            process_registry.get('no.such.Process')
+        with self.assertRaises(ValueError):
+            process_registry.get('json.dumps')
+
+    def test_check_unknown_classes(self):
+        sim_id = pymerlin_adapter.pymerlin2django(create_test_simulation())
+        Process.objects.filter(parent__sim_id=sim_id, name='Budget').update(
+            process_class='no.such.Process')
+        warnings = check_process_classes(None)
+        self.assertEqual(
+            [w.id for w in warnings], ['merlin_api.W001'])
+        self.assertIn('no.such.Process', warnings[0].msg)
+
+    def test_api(self):
+        response = self.client.get('/api/process-classes/')
+        self.assertEqual(response.status_code, 200)
+        name = pymerlin_adapter.get_fullname_from_process_class(
+            CallCenterStaffProcess)
+        described = {c['name']: c for c in response.data}[name]
+        self.assertIn(
+            'staff salary', [p['name'] for p in described['properties']])
+        response = self.client.get('/api/process-classes/{0}/'.format(name))
+        self.assertEqual(response.data['name'], name)
+        response = self.client.get('/api/process-classes/no.such.Process/')
+        self.assertEqual(response.status_code, 404)
+
+
+class WarmupTest(TestCase):
+
+    def test_warmup(self):
+        sim_id = pymerlin_adapter.pymerlin2django(create_test_simulation())
+        simulation_cache.clear()
+        warmup(sim_ids=[sim_id], before_fork=False)
+        dsim = Simulation.objects.get(pk=sim_id)
+        self.assertIsNotNone(simulation_cache.get(sim_id, dsim.revision))
+
+
+class ScenarioLoadingTest(TestCase):
+
+    def setUp(self):
+        self.dsim = Simulation.objects.get(
+            pk=pymerlin_adapter.pymerlin2django(create_test_simulation()))
+        self.scenarios = [
+            create_salary_scenario(self.dsim, t) for t in (2, 3)]
+        other = Simulation.objects.get(
+            pk=pymerlin_adapter.pymerlin2django(create_test_simulation()))
+        self.other_scenario = create_salary_scenario(other, 2)
+
+    def get_scenarios(self, params):
+        request = Request(APIRequestFactory().get('/', params))
+        return SimulationRunViewSet().get_scenarios(request, self.dsim.id)
+
+    def test_batched_loading(self):
+        self.assertEqual(
+            [s.id for s in self.get_scenarios({'scenarios': 'all'})],
+            [s.id for s in self.scenarios])
+
+        with self.assertNumQueries(2):
+            scenarios = self.get_scenarios(
+                {'s0': self.scenarios[1].id, 's1': self.scenarios[0].id})
+            events = [list(s.events.all()) for s in scenarios]
+        self.assertEqual(
+            [s.id for s in scenarios],
+            [self.scenarios[1].id, self.scenarios[0].id])
+        self.assertEqual(len(events[0]), 1)
+
+        response = self.client.get(
+            '/api/simulation-run/{0}/?s0=999999'.format(self.dsim.id))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get('/api/simulation-run/{0}/?s0={1}'.format(
+            self.dsim.id, self.other_scenario.id))
+        self.assertEqual(response.status_code, 404)
+
+    def test_event_cache(self):
+        scenario_cache.clear()
+        msim = pymerlin_adapter.get_pymerlin_simulation(self.dsim)
+        spec = pymerlin_adapter.django_scenario2spec(self.scenarios[0])
+        first = pymerlin_adapter.scenario_spec2pymerlin(spec, msim)
+        second = pymerlin_adapter.scenario_spec2pymerlin(spec, msim)
+        self.assertEqual(len(scenario_cache), 1)
+        self.assertEqual(len(second.events), 1)
+        self.assertIsNot(first.events.pop(), second.events.pop())
+
+        # a changed event bumps the scenario revision
+        Event.objects.create(scenario=self.scenarios[0], time=3, actions=[])
+        scenario = Scenario.objects.get(pk=self.scenarios[0].id)
+        spec = pymerlin_adapter.django_scenario2spec(scenario)
+        third = pymerlin_adapter.scenario_spec2pymerlin(spec, msim)
+        self.assertEqual(len(third.events), 2)
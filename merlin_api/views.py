@@ -1,50 +1,63 @@
+from django.db.models import Count
+from django.http import (
+    HttpResponse, HttpResponseNotModified, StreamingHttpResponse)
+from django.utils.http import quote_etag
 from django.shortcuts import get_object_or_404
-from rest_framework import viewsets
+from rest_framework import mixins, serializers, status, viewsets
+from rest_framework.decorators import detail_route
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
-from . import pymerlin_adapter
+from rest_framework.settings import api_settings
+from . import bulk, conditional, pymerlin_adapter
+from .fast_serializers import serialize_simulation
+from .pagination import (
+    OptionalCursorPagination, RunPagination, SimulationPagination)
+from .process_registry import describe_process_class, process_registry
+from .renderers import (
+    NDJSONRenderer, ORJSONRenderer, TelemetryBinaryRenderer, iter_ndjson)
 from .serializers import *
+from .sparse import SparseFieldsMixin
 from .models import *
+from .telemetry import (
+    DTYPES, decode_telemetry, decompress_telemetry, encode_telemetry)
 
 
 class SimulationRunViewSet(viewsets.GenericViewSet):
     """
-    Runs a merlin simulation and returns the telemetry result.
+    Runs a merlin simulation and returns the telemetry result. Use
+    format=ndjson to stream one telemetry object per line, or format=bin
+    for columnar binary telemetry. With save=true the result is also
+    stored and can be fetched again from /api/runs/.
     """
-    queryset = Simulation.objects.prefetch_related("entities", "outputs",
-                                                 "outputs__inputs",
-                                                 "unittypes", "attributes",
-                                                 "entities__parent",
-                                                 "entities__children",
-                                                 "entities__outputs",
-                                                 "entities__outputs__unit_type",
-                                                 "entities__outputs__endpoints",
-                                                 "entities__outputs__endpoints__input",
-                                                 "entities__outputs__endpoints__sim_output",
-                                                 "entities__inputs",
-                                                 "entities__inputs__unit_type",
-                                                 "entities__inputs__source",
-                                                 "entities__processes",
-                                                 "entities__processes__properties",
-                                                 )
+    queryset = Simulation.objects.all()
     serializer_class = SimulationSerializer
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [
+        NDJSONRenderer, TelemetryBinaryRenderer]
 
-    def retrieve(self, request, pk=None):
-
+    def get_steps(self, request):
         # parse steps arg
         steps_arg = request.query_params.get('steps', -1)
         try:
             steps_arg = int(steps_arg)
         except ValueError:
             steps_arg = -1
+        return steps_arg
 
+    def get_scenarios(self, request, sim_id):
+        """
+        Loads the scenarios named by scenarios=all and the s0..sN
+        parameters, with their events, in one go.
+        """
         scenarios = list()
 
         # parse scenario tag
         scenario_arg = request.query_params.get('scenarios', 'none')
         if scenario_arg == 'all':
-            scenarios = Scenario.objects.all()
+            scenarios = list(Scenario.objects.filter(
+                sim_id=sim_id).prefetch_related('events').order_by('id'))
 
         # parse scenario filters
+        s_ids = list()
         i = 0
         k = 's' + str(i)
         while k in request.query_params:
@@ -52,67 +65,389 @@ class SimulationRunViewSet(viewsets.GenericViewSet):
             i += 1
             k = 's' + str(i)
             try:
-                s_id = int(s_id)
-                scenario = Scenario.objects.prefetch_related("events",
-                                                             "sim",
-                                                             ).get(pk=s_id)
-                scenarios.append(scenario)
+                s_ids.append(int(s_id))
             except ValueError:
                 continue
+        if s_ids:
+            found = Scenario.objects.filter(
+                sim_id=sim_id).prefetch_related('events').in_bulk(s_ids)
+            unknown = set(s_ids) - set(found)
+            if unknown:
+                raise NotFound(
+                    'unknown scenarios {0}'.format(sorted(unknown)))
+            scenarios += [found[s_id] for s_id in s_ids]
+        return scenarios
 
+    def retrieve(self, request, pk=None):
+        steps_arg = self.get_steps(request)
+        scenarios = self.get_scenarios(request, pk)
         sim = get_object_or_404(self.get_queryset(), pk=pk)
 
-        result = pymerlin_adapter.run_simulation(
+        save = request.query_params.get('save') in ('true', '1')
+        etag = None
+        if not save:
+            etag = conditional.run_etag(
+                sim, scenarios, steps_arg,
+                request.accepted_renderer.format,
+                request.query_params.get('dtype'))
+            if conditional.etag_matches(request, etag):
+                response = HttpResponseNotModified()
+                response['ETag'] = quote_etag(etag)
+                return response
+
+        result, duration = pymerlin_adapter.run_simulation_timed(
             sim,
             steps=steps_arg,
             scenarios=scenarios)
-        return Response(result)
+
+        if request.accepted_renderer.format == NDJSONRenderer.format:
+            response = StreamingHttpResponse(
+                iter_ndjson(result),
+                content_type=NDJSONRenderer.media_type)
+        else:
+            response = Response(result)
+
+        if save and not isinstance(result, dict):
+            run = pymerlin_adapter.save_simulation_run(
+                sim, scenarios, steps_arg, result, duration=duration)
+            response['X-Run-Id'] = str(run.id)
+        elif etag is not None and not isinstance(result, dict):
+            response['ETag'] = quote_etag(etag)
+        return response
+
+    @detail_route(methods=['get'])
+    def compare(self, request, pk=None):
+        """
+        Runs the baseline simulation once and each of the s0..sN scenarios
+        separately against it, in parallel.
+        """
+        steps_arg = self.get_steps(request)
+        scenarios = self.get_scenarios(request, pk)
+        sim = get_object_or_404(self.get_queryset(), pk=pk)
+        return Response(pymerlin_adapter.run_comparison(
+            sim, scenarios, steps=steps_arg))
+
+    @detail_route(methods=['post'])
+    def batch(self, request, pk=None):
+        """
+        Runs the simulation once per scenario set in 'variants', in
+        parallel, and returns the telemetry of each variant in order.
+        """
+        sim = get_object_or_404(self.get_queryset(), pk=pk)
+        batch = SimulationBatchSerializer(data=request.data)
+        batch.is_valid(raise_exception=True)
+        variants = batch.validated_data['variants']
+
+        scenarios = Scenario.objects.filter(
+            sim=sim).prefetch_related('events').in_bulk(
+                {s_id for v in variants for s_id in v})
+        unknown = {s_id for v in variants for s_id in v} - set(scenarios)
+        if unknown:
+            raise serializers.ValidationError(
+                {'variants': 'unknown scenarios {0}'.format(sorted(unknown))})
+
+        results = pymerlin_adapter.run_simulation_batch(
+            sim,
+            [[scenarios[s_id] for s_id in v] for v in variants],
+            steps=batch.validated_data['steps'])
+        return Response({
+            'variants': [
+                {'scenarios': v, 'telemetry': r}
+                for v, r in zip(variants, results)]
+        })
+
+    @detail_route(methods=['post'])
+    def sweep(self, request, pk=None):
+        """
+        Runs the simulation for every combination of process property
+        values in 'grid', or for each override set in 'variants', and
+        returns a variant x output x step result cube.
+        """
+        sim = get_object_or_404(self.get_queryset(), pk=pk)
+        sweep = SimulationSweepSerializer(data=request.data)
+        sweep.is_valid(raise_exception=True)
+        data = sweep.validated_data
+
+        if 'grid' in data:
+            overrides = pymerlin_adapter.expand_property_grid(data['grid'])
+        else:
+            overrides = data['variants']
+
+        s_ids = data.get('scenarios', [])
+        scenarios = Scenario.objects.filter(
+            sim=sim).prefetch_related('events').in_bulk(s_ids)
+        if len(scenarios) != len(set(s_ids)):
+            raise serializers.ValidationError(
+                {'scenarios': 'unknown scenario for this simulation'})
+
+        try:
+            cube = pymerlin_adapter.sweep_simulation(
+                sim,
+                overrides,
+                scenarios=[scenarios[s_id] for s_id in s_ids],
+                steps=data['steps'])
+        except ValueError as e:
+            raise serializers.ValidationError({'grid': str(e)})
+        return Response(cube)
+
+
+class SimulationJobViewSet(mixins.CreateModelMixin,
+                           mixins.RetrieveModelMixin,
+                           mixins.ListModelMixin,
+                           viewsets.GenericViewSet):
+    """
+    Queues simulation runs for the background workers (manage.py
+    runsimworker). Poll a job to get its status and, once done, its
+    telemetry result.
+    """
+    queryset = SimulationJob.objects.all()
+    serializer_class = SimulationJobSerializer
+
+    def get_serializer_class(self):
+        if self.action == 'retrieve':
+            return SimulationJobResultSerializer
+        return self.serializer_class
+
+
+class RunViewSet(mixins.DestroyModelMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Stored simulation runs. The list leaves out the telemetry and is
+    paginated when the request passes cursor or page_size. Retrieve a run
+    to get it, as json or with format=bin as columnar binary.
+    """
+    queryset = SimulationRun.objects.all()
+    serializer_class = RunSerializer
+    pagination_class = RunPagination
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [
+        TelemetryBinaryRenderer]
+
+    def get_queryset(self):
+        queryset = self.queryset.order_by('-created')
+        if self.action == 'list':
+            queryset = queryset.defer('telemetry')
+        if 'sim' in self.request.query_params:
+            try:
+                sim_id = int(self.request.query_params['sim'])
+            except ValueError:
+                raise serializers.ValidationError(
+                    {'sim': 'a simulation id is required'})
+            queryset = queryset.filter(sim_id=sim_id)
+        return queryset
+
+    def retrieve(self, request, pk=None):
+        run = self.get_object()
+        if request.accepted_renderer.format == TelemetryBinaryRenderer.format:
+            # stored runs are already encoded as float64, only re-encode
+            # when another dtype is asked for
+            data = decompress_telemetry(run.telemetry)
+            dtype = request.query_params.get('dtype', 'float64')
+            if dtype != 'float64' and dtype in DTYPES:
+                data = encode_telemetry(decode_telemetry(data), dtype)
+            return HttpResponse(
+                data, content_type=TelemetryBinaryRenderer.media_type)
+        return Response(RunResultSerializer(run).data)
 
 
 # Model view sets
 
 
-class ProjectPhaseViewSet(viewsets.ModelViewSet):
+class ProcessClassViewSet(viewsets.ViewSet):
+    """
+    The registered process classes with their parameters and the
+    properties, inputs and outputs they declare. Classes are looked up by
+    the name stored in Process.process_class.
+    """
+    lookup_value_regex = '[^/]+'
+
+    def list(self, request):
+        return Response([
+            describe_process_class(name, the_class)
+            for name, the_class in sorted(
+                process_registry.classes().items())])
+
+    def retrieve(self, request, pk=None):
+        try:
+            the_class = process_registry.get(pk)
+        except ValueError:
+            raise NotFound()
+        return Response(describe_process_class(pk, the_class))
+
+
+class SparseModelViewSet(SparseFieldsMixin, viewsets.ModelViewSet):
+    """
+    Model viewset with ?fields= and ?expand= sparse fieldsets, and cursor
+    pagination when the request passes cursor or page_size.
+    """
+    pagination_class = OptionalCursorPagination
+
+
+class ProjectPhaseViewSet(SparseModelViewSet):
     queryset = ProjectPhase.objects.all()
     serializer_class = ProjectPhaseSerializer
 
 
-class ProjectViewSet(viewsets.ModelViewSet):
+class ProjectViewSet(SparseModelViewSet):
     queryset = Project.objects.all()
     serializer_class = ProjectSerializer
 
 
-class EventViewSet(viewsets.ModelViewSet):
+class EventViewSet(SparseModelViewSet):
     queryset = Event.objects.all()
     serializer_class = EventsSerializer
 
 
-class ScenarioViewSet(viewsets.ModelViewSet):
+class ScenarioViewSet(SparseModelViewSet):
     queryset = Scenario.objects.all()
     serializer_class = ScenarioSerializer
 
 
-class SimulationViewSet(viewsets.ModelViewSet):
-    queryset = Simulation.objects.all()
+class SimulationViewSet(SparseModelViewSet):
+    """
+    Simulations with their whole graph nested. The list is paginated and
+    gives summaries with the size of each simulation instead. On retrieve,
+    view=fast builds the same representation without the serializers and
+    view=compact also gives related objects as ids instead of hyperlinks.
+    """
+    queryset = Simulation.objects.order_by('id')
     serializer_class = SimulationSerializer
+    pagination_class = SimulationPagination
+    renderer_classes = [ORJSONRenderer] + api_settings.DEFAULT_RENDERER_CLASSES
+
+    # count name: (model, lookup from the model to the simulation id)
+    SUMMARY_COUNTS = {
+        'num_entities': (Entity, 'sim_id'),
+        'num_outputs': (Output, 'sim_id'),
+        'num_scenarios': (Scenario, 'sim_id'),
+        'num_processes': (Process, 'parent__sim_id'),
+    }
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return SimulationSummarySerializer
+        return self.serializer_class
+
+    def get_fast_view(self):
+        if self.action != 'retrieve':
+            return None
+        view = self.request.query_params.get('view')
+        return view if view in ('fast', 'compact') else None
 
-
-class UnitTypeViewSet(viewsets.ModelViewSet):
+    def get_queryset(self):
+        if self.get_fast_view():
+            return self.queryset.all()
+        return super().get_queryset()
+
+    def set_counts(self, sims):
+        # one grouped count per relation, counting them in a single query
+        # would join every relation onto every other
+        sim_ids = [sim.id for sim in sims]
+        for name, (model, lookup) in self.SUMMARY_COUNTS.items():
+            counts = dict(
+                model.objects
+                .filter(**{lookup + '__in': sim_ids})
+                .values_list(lookup)
+                .annotate(n=Count('id')))
+            for sim in sims:
+                setattr(sim, name, counts.get(sim.id, 0))
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        sims = list(queryset) if page is None else page
+        self.set_counts(sims)
+        serializer = self.get_serializer(sims, many=True)
+        if page is None:
+            return Response(serializer.data)
+        return self.get_paginated_response(serializer.data)
+
+    def retrieve(self, request, *args, **kwargs):
+        view = self.get_fast_view()
+        # checked before the graph is fetched, a match costs one query
+        etag = conditional.simulation_etag(
+            kwargs['pk'],
+            view,
+            request.accepted_renderer.format,
+            request.query_params.get('fields'),
+            request.query_params.get('expand'))
+        if conditional.etag_matches(request, etag):
+            response = HttpResponseNotModified()
+            response['ETag'] = quote_etag(etag)
+            return response
+
+        if view is None:
+            response = super().retrieve(request, *args, **kwargs)
+        else:
+            response = Response(serialize_simulation(
+                self.get_object(),
+                request,
+                compact=(view == 'compact'),
+                format=self.format_kwarg))
+        if etag is not None:
+            response['ETag'] = quote_etag(etag)
+        return response
+
+    def destroy(self, request, *args, **kwargs):
+        """
+        Deletes the simulation with set based statements. With async=true
+        the deletion is queued as a job instead, and the job is returned.
+        """
+        sim = self.get_object()
+        if request.query_params.get('async') in ('true', '1'):
+            job = SimulationJob.objects.create(
+                kind=SimulationJob.DELETE, sim=sim)
+            return Response(
+                SimulationJobSerializer(job).data,
+                status=status.HTTP_202_ACCEPTED)
+        bulk.delete_simulation(sim.id)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @detail_route(methods=['post'])
+    def clone(self, request, pk=None):
+        """
+        Copies the simulation graph, and its scenarios with
+        {"scenarios": true}. Returns the id of the copy.
+        """
+        sim = self.get_object()
+        options = CloneSerializer(data=request.data)
+        options.is_valid(raise_exception=True)
+        clone_id = bulk.clone_simulation(
+            sim.id,
+            name=options.validated_data.get('name'),
+            scenarios=options.validated_data.get('scenarios', False))
+        return Response({'id': clone_id}, status=status.HTTP_201_CREATED)
+
+    @detail_route(methods=['post'])
+    def layout(self, request, pk=None):
+        """
+        Moves many entities and outputs at once. Takes
+        {"entities": [{"id", "x", "y"}, ...], "outputs": [...]} and returns
+        the number of each that were updated.
+        """
+        sim = self.get_object()
+        layout = LayoutSerializer(data=request.data)
+        layout.is_valid(raise_exception=True)
+        return Response(bulk.update_layout(
+            sim.id,
+            entities=layout.validated_data.get('entities', []),
+            outputs=layout.validated_data.get('outputs', [])))
+
+
+class UnitTypeViewSet(SparseModelViewSet):
     queryset = UnitType.objects.all()
     serializer_class = UnitTypeSerializer
 
 
-class AttributeViewSet(viewsets.ModelViewSet):
+class AttributeViewSet(SparseModelViewSet):
     queryset = Attribute.objects.all()
     serializer_class = AttributeSerializer
 
 
-class OutputViewSet(viewsets.ModelViewSet):
+class OutputViewSet(SparseModelViewSet):
     queryset = Output.objects.all()
     serializer_class = OutputSerializer
 
     def get_queryset(self):
-        queryset = self.queryset
+        queryset = super().get_queryset()
         # parse attribute filters
         if 'a' in self.request.query_params:
             attrs = self.request.query_params.copy().pop('a')
@@ -121,12 +456,12 @@ class OutputViewSet(viewsets.ModelViewSet):
         return queryset
 
 
-class EntityViewSet(viewsets.ModelViewSet):
+class EntityViewSet(SparseModelViewSet):
     queryset = Entity.objects.all()
     serializer_class = EntitySerializer
 
     def get_queryset(self):
-        queryset = self.queryset
+        queryset = super().get_queryset()
         # parse attribute filters
         if 'a' in self.request.query_params:
             attrs = self.request.query_params.copy().pop('a')
@@ -135,31 +470,31 @@ class EntityViewSet(viewsets.ModelViewSet):
         return queryset
 
 
-class OutputConnectorViewSet(viewsets.ModelViewSet):
+class OutputConnectorViewSet(SparseModelViewSet):
     queryset = OutputConnector.objects.all()
     serializer_class = OutputConnectorSerializer
 
 
-class InputConnectorViewSet(viewsets.ModelViewSet):
+class InputConnectorViewSet(SparseModelViewSet):
     queryset = InputConnector.objects.all()
     serializer_class = InputConnectorSerializer
 
 
-class SimOutputConnectorViewSet(viewsets.ModelViewSet):
+class SimOutputConnectorViewSet(SparseModelViewSet):
     queryset = SimOutputConnector.objects.all()
     serializer_class = SimOutputConnectorSerializer
 
 
-class EndpointViewSet(viewsets.ModelViewSet):
+class EndpointViewSet(SparseModelViewSet):
     queryset = Endpoint.objects.all()
     serializer_class = EndpointSerializer
 
 
-class ProcessViewSet(viewsets.ModelViewSet):
+class ProcessViewSet(SparseModelViewSet):
     queryset = Process.objects.all()
     serializer_class = ProcessSerializer
 
 
-class ProcessPropertyViewSet(viewsets.ModelViewSet):
+class ProcessPropertyViewSet(SparseModelViewSet):
     queryset = ProcessProperty.objects.all()
     serializer_class = ProcessPropertySerializer
@@ -0,0 +1,69 @@
+import gc
+import logging
+import time
+from typing import Iterable
+from django.conf import settings
+from django.db import DatabaseError, connections
+from . import models, pymerlin_adapter, serializers
+from .process_registry import process_registry
+
+logger = logging.getLogger('merlin_api.warmup')
+
+# Pre-fork warmup of wsgi workers. Called from merlin/wsgi.py when
+# MERLIN_WARMUP is set in the environment, which under uwsgi without
+# lazy-apps runs once in the master. Everything loaded here is then shared
+# copy-on-write by the forked workers instead of being built by each one
+# on its first request.
+
+
+def warmup(sim_ids: Iterable[int]=None, before_fork: bool=True) -> None:
+    """
+    Resolves the stored process classes, builds the serializer field trees and
+    hydrates hot simulations into the simulation cache.
+    :param sim_ids: simulations to hydrate, MERLIN_WARMUP_SIMULATIONS by
+     default
+    :param before_fork: close the database connections and move everything
+     allocated so far into the permanent gc generation, so collections in
+     the workers don't touch (and copy) it
+    """
+    start = time.perf_counter()
+    if sim_ids is None:
+        sim_ids = getattr(settings, 'MERLIN_WARMUP_SIMULATIONS', [])
+
+    # the nested serializers are bound lazily on first use
+    from . import views  # noqa: F401
+    serializers.get_prefetch_lookups(serializers.SimulationSerializer)
+
+    # the configured process modules are loaded by the app config already,
+    # this resolves any other stored name
+    unknown = dict()
+    hydrated = 0
+    try:
+        unknown = process_registry.preload(
+            models.Process.objects.values_list(
+                'process_class', flat=True).distinct())
+        for sim in models.Simulation.objects.filter(pk__in=list(sim_ids)):
+            try:
+                pymerlin_adapter.get_pymerlin_simulation(sim)
+            except ValueError:
+                logger.exception(
+                    'could not hydrate simulation {0}'.format(sim.id))
+                continue
+            hydrated += 1
+    except DatabaseError:
+        # not migrated yet, or no database, the workers start cold
+        logger.exception('warmup skipped the database')
+
+    if before_fork:
+        # the workers must not share the master's database connections
+        connections.close_all()
+        gc.collect()
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+    logger.info(
+        'warmup done in {0:.2f}s: {1} process classes, {2} simulations, '
+        '{3} unknown process classes'.format(
+            time.perf_counter() - start,
+            len(process_registry.classes()),
+            hydrated,
+            len(unknown)))